@@ -23,9 +23,51 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
 import argparse
+import cProfile
+import cStringIO
+import collections
+import contextlib
+import csv
+import fractions
+import gzip
+import hashlib
+import importlib
+import io
+import itertools
+import json
+import mmap
+import os
+import resource
+import struct
 import sys
+import tempfile
+import time
+import zlib
 import numpy as np
-from matplotlib import pyplot as plt
+
+
+
+
+
+class LazyModule(object):
+    """Stands in for a module until one of its attributes is first used. The
+    module is then imported and replaces the LazyModule under the given name
+    in this module, so only the first use goes through the LazyModule. Used
+    for modules that take long to import and that most runs never need, so 
+    that printing the table does not wait for them: matplotlib.pyplot alone
+    takes about four times as long to import as the rest of the script.
+    """
+    def __init__(self, module, name):
+        self.module = module
+        self.name = name
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self.module)
+        globals()[self.name] = module
+        return getattr(module, attribute)
+
+multiprocessing = LazyModule('multiprocessing', 'multiprocessing')
+plt = LazyModule('matplotlib.pyplot', 'plt')
 
 
 
@@ -65,445 +107,2853 @@ from matplotlib import pyplot as plt
 
 
 
-# This code is partly based on https://github.com/mtop/ngs/blob/master/fp.py
-# by Mats Töpel
+# This code is partly based on https://github.com/mtop/ngs/blob/master/fp.py
+# by Mats Töpel
+
+
+
+
+
+BGZF_BATCH = 4 << 20 # Compressed bytes of BGZF blocks inflated per job.
+COV_BLOCK = 1 << 16 # Lines of the coverage file handled together.
+DEPTH_CHUNK = 16 << 20 # Bytes of a per-base depth file handled together.
+FOLLOW_CHUNK = 4 << 20 # Bytes of a followed fasta file parsed together.
+LENGTH_LARGE = 100000
+LENGTH_SMALL = 10000
+GC_LARGE = 55
+GC_SMALL = 40
+DENSITY_POINTS = 500000 # Scatter plots with more points than this are drawn
+                        # as a density image instead, see densityplot.
+DENSITY_BINS = 400 # Cells per axis of the density image.
+COUNT_CHUNK = 1<<20 # Bytes of a sequence binned at a time by basecount.
+WINDOW_SIZE = 10000 # Default window and step for gcwindows.
+WINDOW_STEP = 1000
+WINDOW_CHUNK = 1<<20 # Bytes of sequence counted at a time by gcwindows.
+KMER_SIZE = 4 # Default k of the k-mer profiles, 4 gives 136 canonical k-mers.
+KMER_MAX = 8 # Largest k for --kmers: 32896 canonical k-mers, a dense profile 
+             # of 128 kb per contig.
+KMER_BATCH = 4<<20 # Bytes of sequence profiled at a time by kmerprofiles.
+KMER_CELLS = 16<<20 # Most contigs x k-mers counted at a time by kmerprofiles.
+TABLE_BLOCK = 1<<16 # Rows formatted at a time by write_table.
+TABLE_COLUMNS = ('name', 'length', 'gc', 'n_count', 'coverage')
+FILTER_BLOCK = 4<<20 # Most bytes of passing records copied at a time by 
+                     # filter_fasta.
+HISTOGRAM_BINS = np.logspace(0.1, 7, 200) # Bins of the length and coverage
+                                          # histograms. These values can be
+                                          # changed to get another range or
+                                          # bin size.
+GC_BINS = np.linspace(0, 100, 101) # Bins of the GC content histogram.
+HISTOGRAM_BLOCK = 1<<20 # Values binned at a time by LogHistogram.add.
+FASTA_EXTENSIONS = ('.fa', '.fasta', '.fna', '.fa.gz', '.fasta.gz', 
+                    '.fna.gz') # Files read from a directory by --batch.
+COVERAGE_EXTENSIONS = ('.cov', '.cov.gz') # Coverage files of --batch, named
+                                          # as the fasta file.
+mark = None
+annotation = None
+plot_table = None # The ContigTable drawn by render_plot.
+plot_matrix = None # The CoverageMatrix of the per sample plots of render_plot.
+
+
+
+
+
+# Every possible byte value is given one of the classes below by BASE_CLASSES,
+# so that a histogram over the bytes of a sequence can be folded into base 
+# counts. Line breaks are not part of the sequence and are counted separately.
+A, C, G, T, N, OTHER, LINEBREAK = range(7)
+BASE_CLASSES = np.empty(256, dtype = np.intp)
+BASE_CLASSES.fill(OTHER)
+for bases, base_class in (('aA', A), ('cC', C), ('gG', G), ('tT', T), 
+                          ('nN', N), ('\n\r', LINEBREAK)):
+    for base in bases:
+        BASE_CLASSES[ord(base)] = base_class
+del bases, base_class, base
+# A, C, G and T are 0 to 3, so the classes are also the 2-bit codes of the 
+# bases in k-mers.
+BASE_CODES = BASE_CLASSES.astype(np.uint8)
+
+
+
+
+
+def basecount(seq):
+    """Count A, C, G, T, N and other characters (case insensitive) in a 
+    single pass over the sequence. The argument needed is the sequence as a 
+    string. Returns a tuple (a, c, g, t, n, other), line breaks are not 
+    counted. The bytes are binned COUNT_CHUNK at a time, since bincount 
+    needs a copy of its input eight times as large.
+    """
+    codes = np.frombuffer(seq, dtype = np.uint8)
+    histogram = np.zeros(256, dtype = np.int64)
+    for i in xrange(0, len(codes), COUNT_CHUNK):
+        histogram += np.bincount(codes[i:i + COUNT_CHUNK], minlength = 256)
+    counts = np.bincount(BASE_CLASSES, weights = histogram, minlength = 7)
+    return tuple(int(count) for count in counts[:LINEBREAK])
+
+
+
+
+
+def gcwindows(seq, window = WINDOW_SIZE, step = WINDOW_STEP):
+    """Calculate GC content and GC skew, (G - C) / (G + C), in windows along
+    the sequence. The arguments needed are the sequence and the window size
+    and step in bases. Sequences shorter than the window get one window over
+    the whole sequence. The sequence is cut at every window start and end, 
+    the bases between two cuts are counted in blocks of WINDOW_CHUNK bytes 
+    and the window counts are differences of the cumulative sums of those 
+    counts, so there is no loop over the windows or the bases. Returns NumPy
+    arrays with the start (0-based) and end of each window, its GC content 
+    (%, rounded to one decimal as by gcpercent) and its GC skew.
+    """
+    codes = np.frombuffer(seq, dtype = np.uint8)
+    length = len(seq) - seq.count('\n') - seq.count('\r')
+    starts = np.arange(0, max(length - window, 0) + 1, step)
+    ends = np.minimum(starts + window, length)
+    unit = fractions.gcd(window, step)
+    if length <= 2 * len(starts) * unit:
+        # Every start and end is on a grid of unit bases, or at length.
+        cuts = np.r_[np.arange(0, length, unit), length]
+        locate = lambda positions: -(-positions // unit)
+    else:
+        cuts = np.union1d(starts, ends)
+        locate = lambda positions: np.searchsorted(cuts, positions)
+    segments = np.zeros((3, len(cuts)), dtype = np.int64)
+    offset = 0
+    for i in xrange(0, len(codes), WINDOW_CHUNK):
+        chunk = codes[i:i + WINDOW_CHUNK]
+        if length != len(seq):
+            chunk = chunk[(chunk != 10) & (chunk != 13)]
+        if not len(chunk):
+            continue
+        lower = chunk | 32
+        g = lower == ord('g')
+        c = lower == ord('c')
+        acgt = g | c | (lower == ord('a')) | (lower == ord('t'))
+        first = np.searchsorted(cuts, offset, 'right') - 1
+        last = np.searchsorted(cuts, offset + len(chunk))
+        inside = np.r_[0, cuts[first + 1:last] - offset]
+        for row, bases in enumerate((g, c, acgt)):
+            segments[row, first:first + len(inside)] += np.add.reduceat(
+                bases, inside, dtype = np.int64)
+        offset += len(chunk)
+    cumulative = np.zeros((3, len(cuts) + 1), dtype = np.int64)
+    np.cumsum(segments, axis = 1, out = cumulative[:, 1:])
+    g, c, acgt = (cumulative[:, locate(ends)] - 
+                  cumulative[:, locate(starts)])
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        gc = (g + c).astype(np.float64) / acgt * 100
+        # Rounded as by gcpercent (half away from zero), not as np.round.
+        gc = np.array([round(value, 1) for value in gc.tolist()])
+        skew = (g - c) / (g + c).astype(np.float64)
+    return starts, ends, gc, skew
+
+
+
+
+
+def write_gcwindows(infile, outfile, window = WINDOW_SIZE, 
+                    step = WINDOW_STEP):
+    """Write the GC content and GC skew in windows along every sequence in 
+    a fasta file to outfile, one line per window with the contig name, 
+    start (0-based), end, GC content and GC skew separated by tabs. Only one
+    sequence is kept in memory at a time.
+    """
+    for fs in iter_records(infile):
+        starts, ends, gc, skew = gcwindows(fs.seq, window, step)
+        row = fs.header().replace('%', '%%') + '\t%d\t%d\t%.1f\t%.4f\n'
+        outfile.write(''.join([row % values for values 
+                               in zip(starts, ends, gc, skew)]))
+
+
+
+
+
+def gcskewplot(name, starts, ends, gc, skew, outfile = None):
+    """Plot GC content and GC skew along one contig, from the windows 
+    calculated by gcwindows. If outfile is given, the plot is saved to it 
+    instead of shown.
+    """
+    middle = (starts + ends) / 2.0
+    fig = plt.figure()
+    ax = fig.add_subplot(211)
+    ax.plot(middle, gc, color = 'b')
+    ax.set_ylabel('GC content (%)')
+    ax = fig.add_subplot(212, sharex = ax)
+    ax.plot(middle, skew, color = 'r')
+    ax.axhline(0, color = 'k', linewidth = 0.5)
+    ax.set_ylabel('GC skew')
+    ax.set_xlabel('Position (nt)')
+    plt.suptitle('GC - %s' % name, fontsize = 20)
+    showplot(fig, outfile)
+    return middle.tolist(), gc.tolist(), skew.tolist()
+
+
+
+
+
+def findrecord(infile, name):
+    """Return the sequence with the given name from a fasta file as an 
+    object of the class Fasta, or None. Uses the .fai index when the file is
+    uncompressed and on disk, and otherwise (or if the file can't be 
+    indexed) reads until the sequence.
+    """
+    if isplainfile(infile):
+        try:
+            fasta = IndexedFasta(infile.name)
+        except (IOError, ValueError):
+            fasta = None
+        if fasta is not None:
+            try:
+                if name in fasta:
+                    return fasta.record(name)
+                return None
+            finally:
+                fasta.close()
+    for fs in iter_records(infile):
+        if fs.header() == name or indexname(fs.header()) == name:
+            return fs
+    return None
+
+
+
+
+
+def canonical_kmers(k):
+    """Return the canonical k-mers, the lesser of each k-mer and its reverse
+    complement in 2-bit code, as a list of strings and an array that gives 
+    the position of the canonical form in that list for every k-mer code.
+    """
+    codes = np.arange(4 ** k, dtype = np.int64)
+    reverse = np.zeros_like(codes)
+    remaining = codes.copy()
+    for i in xrange(k):
+        reverse = (reverse << 2) | (3 - (remaining & 3))
+        remaining >>= 2
+    canonical = np.minimum(codes, reverse)
+    kmers = np.unique(canonical)
+    names = []
+    for code in kmers:
+        names.append(''.join('acgt'[(code >> 2 * (k - i - 1)) & 3] 
+                             for i in xrange(k)))
+    return names, np.searchsorted(kmers, canonical)
+
+
+
+
+
+def kmerprofiles(seqs, k = KMER_SIZE, columns = None):
+    """Calculate canonical k-mer frequencies for a list of sequences. The 
+    sequences are joined with an N between them and 2-bit encoded, the k-mer
+    codes are built for every position at once by shifting the codes k 
+    times, k-mers containing N or other characters are skipped and all 
+    k-mers are counted with a single bincount. columns is the second value 
+    from canonical_kmers(k), calculated if not given. Returns a float32 
+    array with one row per sequence and one column per canonical k-mer, 
+    where each row sums to 1 (or 0 if the sequence has no valid k-mer).
+    """
+    if columns is None:
+        columns = canonical_kmers(k)[1]
+    # Skipped k-mers are counted in an extra column that is dropped at the 
+    # end, which is cheaper than removing them from the arrays.
+    width = columns.max() + 2
+    joined = 'N'.join(seqs)
+    codes = BASE_CODES[np.frombuffer(joined, dtype = np.uint8)]
+    lengths = np.array([len(seq) - seq.count('\n') - seq.count('\r') 
+                        for seq in seqs], dtype = np.intp)
+    if len(codes) != lengths.sum() + len(seqs) - 1:
+        codes = codes[codes != LINEBREAK]
+    positions = max(len(codes) - k + 1, 0)
+    if k <= 4:
+        dtype = np.uint8
+    elif k <= 8:
+        dtype = np.uint16
+    else:
+        dtype = np.uint32
+    bases = (codes & 3).astype(dtype)
+    unknown = codes > T
+    kmers = bases[:positions].copy()
+    skip = unknown[:positions].copy()
+    for i in xrange(1, k):
+        kmers <<= 2
+        kmers |= bases[i:i + positions]
+        skip |= unknown[i:i + positions]
+    keys = np.repeat(np.arange(0, len(seqs) * width, width, dtype = np.int64),
+                     lengths + 1)[:positions]
+    kmers = columns.astype(np.int64).take(kmers)
+    kmers[skip] = width - 1
+    keys += kmers
+    counts = np.bincount(keys, minlength = len(seqs) * width)
+    counts = counts.reshape(len(seqs), width)[:, :-1].astype(np.float32)
+    totals = counts.sum(axis = 1)[:, np.newaxis]
+    return np.divide(counts, totals, out = np.zeros_like(counts), 
+                     where = totals > 0)
+
+
+
+
+
+def write_kmerprofiles(infile, path, k = KMER_SIZE):
+    """Calculate canonical k-mer frequencies (see kmerprofiles) for every 
+    sequence in a fasta file and save them to path as a NumPy .npz file with
+    the arrays names (contig names), kmers (the canonical k-mers) and 
+    profiles (contigs x k-mers, float32). Sequences are read and profiled in
+    batches of about KMER_BATCH bytes, with fewer contigs when contigs x 
+    k-mers would be more than KMER_CELLS, since every contig of a batch has 
+    a count for every k-mer.
+    """
+    kmers, columns = canonical_kmers(k)
+    width = len(kmers) + 1
+    names, profiles, batch, size = [], [], [], 0
+    for fs in iter_records(infile):
+        names.append(fs.header())
+        batch.append(fs.seq)
+        size += len(fs.seq)
+        if size >= KMER_BATCH or (len(batch) + 1) * width > KMER_CELLS:
+            profiles.append(kmerprofiles(batch, k, columns))
+            batch, size = [], 0
+    if batch or not profiles:
+        profiles.append(kmerprofiles(batch, k, columns))
+    with open(path, 'wb') as outfile:
+        np.savez(outfile, names = np.array(names, dtype = str), 
+                 kmers = np.array(kmers), 
+                 profiles = np.concatenate(profiles))
+
+
+
+
+
+def gcpercent(gc, total):
+    """Return the number of G and C as a percentage of the total number of 
+    G, C, A and T, rounded to one decimal. Returns 'nan' if the total is 0.
+    """
+    if total == 0:
+        return float('nan')
+    return round((float(gc) / total) * 100, 1)
+
+
+
+
+
+class PackedSequence(object):
+    """A sequence stored with 2 bits per base, four bases to a byte, which is
+    about a quarter of the memory of the sequence as a string. Everything 
+    that is not A, C, G or T (N and other ambiguity codes) is kept as a list
+    of runs (start, length, character) and stored as A in the packed bases. 
+    The base counts are calculated once when packing, so length, GC content
+    and N content never need the sequence to be unpacked. The sequence is 
+    only decoded when decode is called. The sequence is stored in lower 
+    case. Line breaks are kept apart in breaks, as runs of equal distances 
+    between them and their characters (one character if they are all the 
+    same), so that decode gives back the lines as they were read while a 
+    file with lines of equal length needs only a few numbers for them.
+    """
+    __slots__ = ('length', 'bases', 'runs', 'counts', 'breaks')
+
+    def __init__(self, seq):
+        data = np.frombuffer(seq, dtype = np.uint8)
+        codes = BASE_CODES[data]
+        self.breaks = None
+        if '\n' in seq or '\r' in seq:
+            keep = codes != LINEBREAK
+            positions = np.flatnonzero(~keep)
+            gaps = np.diff(np.r_[-1, positions])
+            first = np.flatnonzero(np.r_[True, gaps[1:] != gaps[:-1]])
+            chars = data[positions].tostring()
+            if chars == chars[0] * len(chars):
+                chars = chars[0]
+            self.breaks = (gaps[first], np.diff(np.r_[first, len(gaps)]), 
+                           chars)
+            data, codes = data[keep], codes[keep]
+        self.length = len(codes)
+        self.counts = tuple(int(count) for count 
+                            in np.bincount(codes, minlength = 7)[:LINEBREAK])
+        self.runs = ()
+        if self.length - sum(self.counts[:N]):
+            positions = np.flatnonzero(codes > T)
+            chars = data[positions] | 32 # Lower case.
+            first = np.flatnonzero((np.diff(positions) != 1) | 
+                                   (np.diff(chars) != 0)) + 1
+            first = np.r_[0, first]
+            sizes = np.diff(np.r_[first, len(positions)])
+            self.runs = tuple(zip(positions[first].tolist(), sizes.tolist(), 
+                                  chars[first].tostring()))
+        padded = np.zeros(-(-self.length // 4) * 4, dtype = np.uint8)
+        padded[:self.length] = codes & 3
+        padded = padded.reshape(-1, 4)
+        self.bases = (padded[:, 0] << 6 | padded[:, 1] << 4 | 
+                      padded[:, 2] << 2 | padded[:, 3]).tostring()
+
+    def __len__(self):
+        return self.length
+
+    def decode(self):
+        """Return the sequence as a lower case string, with the line breaks 
+        where they were.
+        """
+        packed = np.frombuffer(self.bases, dtype = np.uint8)
+        codes = np.empty((len(packed), 4), dtype = np.uint8)
+        for i in xrange(4):
+            codes[:, i] = (packed >> (6 - 2 * i)) & 3
+        letters = np.frombuffer('acgt', dtype = np.uint8)[codes.ravel()]
+        letters = letters[:self.length]
+        for start, size, char in self.runs:
+            letters[start:start + size] = ord(char)
+        if self.breaks is not None:
+            gaps, repeats, chars = self.breaks
+            positions = np.cumsum(np.repeat(gaps, repeats)) - 1
+            chars = np.frombuffer(chars, dtype = np.uint8)
+            if len(chars) == 1:
+                chars = np.repeat(chars, len(positions))
+            # Each break goes before the base it was followed by.
+            letters = np.insert(letters, positions - np.arange(len(positions)),
+                                chars)
+        return letters.tostring()
+
+
+
+
+
+class Fasta(object):
+    """Each sequence becomes one object of the class Fasta. The base counts 
+    are calculated the first time they are needed and then kept, so every 
+    later call to length, gccount or ncontent is cheap. With packed = True,
+    the sequence is stored as a PackedSequence instead of a string.
+    """
+    __slots__ = ('name', 'seq', 'cov', 'counts')
+
+    def __init__(self, name, seq, packed = False):
+        self.name = name[1:].rstrip() # The name equals the contig header minus the '>'.
+        self.seq = seq
+        self.cov = float('nan')	# For missing coverage values, 
+                                # covgcplot will not plot.
+        self.counts = None
+        if packed:
+            self.pack()
+
+    def header(self):
+        return self.name
+
+    def pack(self):
+        """Store the sequence as a PackedSequence."""
+        if not isinstance(self.seq, PackedSequence):
+            self.seq = PackedSequence(self.seq)
+            self.counts = self.seq.counts
+
+    def sequence(self):
+        if isinstance(self.seq, PackedSequence):
+            return self.seq.decode()
+        return self.seq.lower()
+
+    def basecount(self):
+        if self.counts is None:
+            self.counts = basecount(self.seq)
+        return self.counts
+
+    def length(self):
+        return sum(self.basecount())
+
+    # Calculates the number of G and C relative to the 
+    # total number of G, C, A and T.
+    def gccount(self):
+        a, c, g, t, n, other = self.basecount()
+        return gcpercent(g + c, a + c + g + t)
+
+    def getcoverage(self):
+        return self.cov
+
+    def setcoverage(self, cov):
+        self.cov = cov
+
+    def ncontent(self):
+        return self.basecount()[N]
+
+    def stats(self):
+        """Return the length, GC content and N content of the sequence as an 
+        object of the class ContigStats, which does not keep the sequence.
+        """
+        return ContigStats(self.name, self.length(), self.gccount(), 
+                           self.ncontent())
+
+
+
+
+
+class ContigStats(object):
+    """Length, GC content and N content of one sequence, without the sequence
+    itself. Has the same methods as the class Fasta (except sequence), so it 
+    can be used in its place by the plot functions and read_covfile.
+    """
+    __slots__ = ('name', 'len', 'gc', 'n', 'cov')
+
+    def __init__(self, name, length, gc, n):
+        self.name = name
+        self.len = length
+        self.gc = gc
+        self.n = n
+        self.cov = float('nan')
+
+    def header(self):
+        return self.name
+
+    def length(self):
+        return self.len
+
+    def gccount(self):
+        return self.gc
+
+    def getcoverage(self):
+        return self.cov
+
+    def setcoverage(self, cov):
+        self.cov = cov
+
+    def ncontent(self):
+        return self.n
+
+
+
+
+
+class ContigTable(object):
+    """Statistics for many contigs stored column by column. name, length, 
+    gc, n_count and coverage are NumPy arrays of the same size, where the 
+    values at one index all belong to the same contig. Used by the plot 
+    functions and run() instead of looping over a dictionary.
+    """
+    def __init__(self, name, length, gc, n_count, coverage = None):
+        self.name = np.asarray(name, dtype = object)
+        self.length = np.asarray(length, dtype = np.int64)
+        self.gc = np.asarray(gc, dtype = np.float64)
+        self.n_count = np.asarray(n_count, dtype = np.int64)
+        if coverage is None:
+            coverage = np.empty(len(self.name))
+            coverage.fill(np.nan) # Missing coverage, as in the class Fasta.
+        self.coverage = np.asarray(coverage, dtype = np.float64)
+        self.index = None
+
+    @classmethod
+    def from_records(cls, records):
+        """Build the table from objects of the class Fasta or ContigStats, 
+        in the order they are given.
+        """
+        name, length, gc, n_count, coverage = [], [], [], [], []
+        for record in records:
+            name.append(record.header())
+            length.append(record.length())
+            gc.append(record.gccount())
+            n_count.append(record.ncontent())
+            coverage.append(record.getcoverage())
+        return cls(name, length, gc, n_count, coverage)
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        """Build the table from a dictionary where the item is an object of 
+        the class Fasta or ContigStats, in the order of the dictionary.
+        """
+        return cls.from_records(dictionary[key] for key in dictionary)
+
+    def __len__(self):
+        return len(self.name)
+
+    # The table can also be used like a dictionary of contigs, as by 
+    # read_covfile: table[name] gives an object of the class ContigRow.
+    def rows(self):
+        """Dictionary where the key is the name of the contig and the item 
+        is its index in the table. Built the first time it is needed.
+        """
+        if self.index is None:
+            self.index = dict(zip(self.name, xrange(len(self.name))))
+        return self.index
+
+    def __contains__(self, name):
+        return name in self.rows()
+
+    def __getitem__(self, name):
+        return ContigRow(self, self.rows()[name])
+
+    def __iter__(self):
+        return iter(self.name)
+
+    def keys(self):
+        return self.name.tolist()
+
+    @classmethod
+    def concatenate(cls, tables):
+        """Return one table with the rows of all the tables, in order."""
+        return cls(*[np.concatenate([getattr(table, column) 
+                                     for table in tables]) 
+                     for column in TABLE_COLUMNS])
+
+    def with_coverage(self, coverage):
+        """Return a new table with the same contigs and the given coverage
+        column, such as one sample of a CoverageMatrix.
+        """
+        return ContigTable(self.name, self.length, self.gc, self.n_count, 
+                           coverage)
+
+    def take(self, rows):
+        """Return a new table with only the given rows, which can be a 
+        boolean mask or an array of indices.
+        """
+        return ContigTable(self.name[rows], self.length[rows], self.gc[rows], 
+                           self.n_count[rows], self.coverage[rows])
+
+    def sorted(self):
+        """Return a new table sorted by contig name."""
+        return self.take(np.argsort(self.name, kind = 'mergesort'))
+
+    def covered(self):
+        """Boolean mask of the contigs that have a coverage value."""
+        return ~np.isnan(self.coverage)
+
+    def length_classes(self):
+        """Boolean masks of the contigs shorter than LENGTH_SMALL, between 
+        LENGTH_SMALL and LENGTH_LARGE, and longer than LENGTH_LARGE.
+        """
+        return (self.length < LENGTH_SMALL, 
+                (LENGTH_SMALL <= self.length) & (self.length <= LENGTH_LARGE),
+                self.length > LENGTH_LARGE)
+
+    def gc_classes(self):
+        """Boolean masks of the contigs with GC content below GC_SMALL, 
+        between GC_SMALL and GC_LARGE, and above GC_LARGE. Contigs without a
+        GC content ('nan') are in none of them.
+        """
+        with np.errstate(invalid = 'ignore'):
+            return (self.gc < GC_SMALL, 
+                    (GC_SMALL <= self.gc) & (self.gc <= GC_LARGE),
+                    self.gc > GC_LARGE)
+
+    def info(self, row):
+        """Text about one contig, shown when it is picked in a plot."""
+        return "%s \n Length: %r \n GC: %r \n Coverage: %r \n N: %r" \
+               %(self.name[row], self.length[row].item(), 
+                 self.gc[row].item(), self.coverage[row].item(), 
+                 self.n_count[row].item())
+
+
+
+
+
+class ContigRow(object):
+    """One contig in a ContigTable, with the same methods as the class 
+    ContigStats. setcoverage changes the coverage in the table.
+    """
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def header(self):
+        return self.table.name[self.row]
+
+    def length(self):
+        return self.table.length[self.row].item()
+
+    def gccount(self):
+        return self.table.gc[self.row].item()
+
+    def getcoverage(self):
+        return self.table.coverage[self.row].item()
+
+    def setcoverage(self, cov):
+        self.table.coverage[self.row] = cov
+
+    def ncontent(self):
+        return self.table.n_count[self.row].item()
+
+
+
+
+
+def as_table(contigs):
+    """Return contigs as a ContigTable. The argument needed is a ContigTable,
+    which is returned as it is, or a dictionary where the item is an object 
+    of the class Fasta and the key is the name of the contig.
+    """
+    if isinstance(contigs, ContigTable):
+        return contigs
+    return ContigTable.from_dict(contigs)
+
+
+
+
+
+PICK_RADIUS = 5 # Pixels from a point within which a click picks it.
+
+
+
+
+
+class PointIndex(object):
+    """Grid over the points of a plot in display (pixel) coordinates, used to
+    find the point nearest to the cursor without looking at every point. 
+    The cells are PICK_RADIUS pixels wide, so only the 3 x 3 cells around 
+    the cursor need to be searched. The points are sorted by cell, so 
+    finding a cell is a binary search. The grid is built again the first 
+    time it is used after the axes have been zoomed, panned or resized.
+    """
+    def __init__(self, ax, xlist, ylist, radius = PICK_RADIUS):
+        self.ax = ax
+        self.points = np.column_stack([xlist, ylist]).astype(np.float64)
+        self.radius = radius
+        self.keys = None
+        ax.callbacks.connect('xlim_changed', self.reset)
+        ax.callbacks.connect('ylim_changed', self.reset)
+        ax.figure.canvas.mpl_connect('resize_event', self.reset)
+
+    def reset(self, *args):
+        self.keys = None
+
+    def cells(self, display):
+        """Cell key of each point. Points far outside the axes share cells 
+        at the edge of the grid, which is harmless since distances are 
+        always checked.
+        """
+        cells = np.clip(np.floor(display / self.radius), -2**30, 2**30)
+        cells = cells.astype(np.int64)
+        return cells[..., 0] * 2**32 + cells[..., 1]
+
+    def build(self):
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            display = self.ax.transData.transform(self.points)
+        rows = np.flatnonzero(np.isfinite(display).all(axis = 1))
+        keys = self.cells(display[rows])
+        order = np.argsort(keys, kind = 'mergesort')
+        self.keys = keys[order]
+        self.rows = rows[order]
+        self.display = display[self.rows]
+
+    def nearest(self, x, y):
+        """Return the index of the point nearest to the display coordinates 
+        x, y, or None if no point is within the radius.
+        """
+        if self.keys is None:
+            self.build()
+        key = self.cells(np.array([x, y], dtype = np.float64))
+        neighbours = (key + np.array([-2**32, 0, 2**32])[:, None] + 
+                      np.array([-1, 0, 1])).ravel()
+        starts = np.searchsorted(self.keys, neighbours, side = 'left')
+        ends = np.searchsorted(self.keys, neighbours, side = 'right')
+        found = np.concatenate([np.arange(start, end) for start, end 
+                                in zip(starts, ends)])
+        if not len(found):
+            return None
+        distance = ((self.display[found] - (x, y))**2).sum(axis = 1)
+        best = distance.argmin()
+        if distance[best] > self.radius**2:
+            return None
+        return self.rows[found[best]]
+
+
+
+
+
+def connect_picker(fig, ax, table, xlist, ylist, color):
+    """Let the user click on a point in the plot to mark it and show the 
+    statistics of that contig (press control to remove them again), and show
+    the name of the contig under the cursor next to the coordinates. The 
+    arguments needed are the figure, the axes, a ContigTable and the x and y
+    values plotted for its contigs, and the color of the mark. Points are 
+    found with a PointIndex.
+    """
+    contig = conname(None)
+    index = PointIndex(ax, xlist, ylist)
+
+    def onclick(event):
+        global annotation
+        global mark
+        if event.inaxes is not ax or event.button != 1:
+            return
+        row = index.nearest(event.x, event.y)
+        if row is None:
+            return
+        if mark != None: 
+            try:
+                ax.lines.remove(mark)
+                annotation.remove()
+            except ValueError:
+                pass
+        contig.name = table.name[row]
+        mark, = ax.plot(xlist[row], ylist[row], color = color, marker = 'o')
+        annotation = ax.text(0.8, 0.15, table.info(row), 
+                             horizontalalignment='center', 
+                             verticalalignment='center', 
+                             transform = ax.transAxes)
+        fig.canvas.draw()
+
+    def on_key(event):
+        global annotation
+        global mark
+        if event.key == 'control':
+            try:
+                annotation.remove()
+                ax.lines.remove(mark)
+                fig.canvas.draw()
+            except (AttributeError, ValueError): 
+                pass
+
+    def format_coord(x, y):
+        """ format_coord shows the name of the contig under the cursor, or 
+        else the last picked contig (if any), in the lower right corner of 
+        the plot, where x and y coordinates are shown.
+        """
+        row = index.nearest(*ax.transData.transform((x, y)))
+        name = contig.name if row is None else table.name[row]
+        if name:
+            return 'x=%.4f, y=%.4f, name: %s'%(x, y, name)
+        else:
+            return 'x=%.4f, y=%.4f'%(x, y)
+
+    fig.canvas.mpl_connect('button_press_event', onclick)
+    fig.canvas.mpl_connect('key_press_event', on_key)
+    ax.format_coord = format_coord
+    return index
+
+
+
+
+
+class conname(object):
+    """Store the contig name so that it is easily available to the onpick and 
+    format_coord functions."""
+    def __init__(self, name):
+        self.name = name
+
+
+
+
+
+def open_input(path):
+    """Open a fasta or coverage file for reading. gzip compressed files are 
+    decompressed while they are read, and BGZF files (such as those written
+    by bgzip) are decompressed by several processes. '-' means stdin. Used as
+    the argparse type of the infiles.
+    """
+    if path == '-':
+        return sys.stdin
+    try:
+        with open(path, 'rb') as infile:
+            magic = infile.read(18)
+        if magic[:2] != '\x1f\x8b':
+            return open(path, 'r')
+        if isbgzf(magic):
+            return BgzfReader(path)
+        return io.BufferedReader(gzip.open(path, 'rb'))
+    except IOError as error:
+        raise argparse.ArgumentTypeError("can't open '%s': %s" %(path, error))
+
+
+
+
+
+def isbgzf(header):
+    """Tests if the first bytes of a gzip file are a BGZF block header."""
+    return len(header) >= 18 and ord(header[3]) & 4 and \
+           header[12:14] == 'BC' and header[14:16] == '\x02\x00'
+
+
+
+
+
+def bgzf_blocksize(data, offset):
+    """Return the size in bytes of the BGZF block that starts at offset in 
+    data, read from the BC field of its gzip header.
+    """
+    xlen, = struct.unpack('<H', data[offset + 10:offset + 12])
+    extra = data[offset + 12:offset + 12 + xlen]
+    pos = 0
+    while pos + 4 <= len(extra):
+        slen, = struct.unpack('<H', extra[pos + 2:pos + 4])
+        if extra[pos:pos + 2] == 'BC' and slen == 2:
+            return struct.unpack('<H', extra[pos + 4:pos + 6])[0] + 1
+        pos += 4 + slen
+    raise IOError("Not a BGZF block at byte %d." % offset)
+
+
+
+
+
+def inflate_blocks(job):
+    """Decompress the BGZF blocks in one byte range of a file. Run in a 
+    worker process by BgzfReader. The argument needed is a tuple (path, 
+    start, end) where start and end are block boundaries.
+    """
+    path, start, end = job
+    with open(path, 'rb') as infile:
+        infile.seek(start)
+        data = infile.read(end - start)
+    parts = []
+    offset = 0
+    while offset < len(data):
+        blocksize = bgzf_blocksize(data, offset)
+        xlen, = struct.unpack('<H', data[offset + 10:offset + 12])
+        parts.append(zlib.decompress(
+                     data[offset + 12 + xlen:offset + blocksize - 8], -15))
+        offset += blocksize
+    return ''.join(parts)
+
+
+
+
+
+class BgzfReader(object):
+    """Read a BGZF compressed file line by line, like a file opened for 
+    reading. The blocks are decompressed in batches of about BGZF_BATCH 
+    bytes by a pool of processes, a few batches ahead of the lines being 
+    read, so memory use does not grow with the file size. As a file, it is
+    its own iterator: lines read by next or readline are not read again 
+    until seek(0) starts over from the first line, which is the only seek 
+    supported.
+    """
+    def __init__(self, path, processes = None):
+        self.name = path
+        self.processes = processes or multiprocessing.cpu_count()
+        self.lines = None # The generator from iterlines, once reading starts.
+
+    def seek(self, offset):
+        if offset != 0:
+            raise IOError("Can only seek to the start of a BGZF file.")
+        self.close()
+
+    def close(self):
+        if self.lines is not None:
+            self.lines.close() # Stops the pool of chunks.
+            self.lines = None
+
+    def batches(self):
+        """Yield (start, end) byte ranges of whole blocks."""
+        with open(self.name, 'rb') as infile:
+            size = os.path.getsize(self.name)
+            if size == 0:
+                return
+            data = mmap.mmap(infile.fileno(), 0, access = mmap.ACCESS_READ)
+            start = offset = 0
+            while offset < size:
+                offset += bgzf_blocksize(data, offset)
+                if offset - start >= BGZF_BATCH:
+                    yield start, offset
+                    start = offset
+            if offset > start:
+                yield start, offset
+            data.close()
+
+    def chunks(self):
+        """Yield the decompressed file in order, one batch at a time."""
+        if self.processes == 1: # Also works inside a worker process.
+            for start, end in self.batches():
+                yield inflate_blocks((self.name, start, end))
+            return
+        pool = multiprocessing.Pool(self.processes)
+        pending = collections.deque()
+        try:
+            for start, end in self.batches():
+                pending.append(pool.apply_async(inflate_blocks, 
+                                                ((self.name, start, end),)))
+                if len(pending) >= 2 * self.processes:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def iterlines(self):
+        """Yield the lines of the whole file."""
+        for chunk in iter_chunks(self):
+            for line in cStringIO.StringIO(chunk):
+                yield line
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.lines is None:
+            self.lines = self.iterlines()
+        return next(self.lines)
+
+    def readline(self):
+        """Return the next line, or '' at the end of the file."""
+        try:
+            return self.next()
+        except StopIteration:
+            return ''
+
+
+
+
+
+def iter_chunks(infile, size = DEPTH_CHUNK):
+    """Yield the contents of a file in pieces of about size bytes that end 
+    with a complete line. A BgzfReader is read one batch of blocks at a time.
+    """
+    if isinstance(infile, BgzfReader):
+        pieces = infile.chunks()
+    else:
+        pieces = iter(lambda: infile.read(size), '')
+    rest = ''
+    for piece in pieces:
+        piece = rest + piece
+        cut = piece.rfind('\n') + 1 # A line can continue in the next piece.
+        rest = piece[cut:]
+        if cut:
+            yield piece[:cut]
+    if rest:
+        yield rest
+
+
+
+
+
+def isplainfile(infile):
+    """Tests if infile is an uncompressed file on disk (not stdin), which is 
+    needed for random access and for reading parts of it in parallel.
+    """
+    return isinstance(infile, file) and infile is not sys.stdin
+
+
+
+
+
+def read_covfile(infile, dictionary):
+    """Read coverage file and add coverage for each contig to the dictionary.
+    The arguments needed are a coverage file and a ContigTable, or a 
+    dictionary where the item is an object of the class Fasta and the key is
+    the name of the contig. The file is read in blocks of COV_BLOCK lines; 
+    names are looked up in a dictionary and the coverage values of a block 
+    are converted together and written straight into the coverage column of
+    a ContigTable. Lines with unknown names or unreadable values are counted
+    and reported once at the end.
+    """
+    infile.seek(0)
+    istable = isinstance(dictionary, ContigTable)
+    if istable:
+        rows = dictionary.rows()
+    unmatched, unreadable = [], [] # The first bad line and the number of 
+    lineno = 0                     # bad lines, see countline.
+    while True:
+        lines = list(itertools.islice(infile, COV_BLOCK))
+        if not lines:
+            break
+        names, values, linenos = [], [], []
+        for line in lines:
+            lineno += 1
+            fields = line.split('\t')
+            if len(fields) < 2:
+                countline(unreadable, lineno)
+            elif fields[0] not in dictionary:
+                countline(unmatched, lineno)
+            else:
+                names.append(fields[0])
+                values.append(fields[1])
+                linenos.append(lineno)
+        covs = tofloats(values)
+        readable = ~np.isnan(covs)
+        for i in np.flatnonzero(~readable):
+            if values[i].strip().lower() != 'nan':
+                countline(unreadable, linenos[i])
+        if istable:
+            index = np.array([rows[name] for name in names], dtype = np.intp)
+            dictionary.coverage[index[readable]] = covs[readable]
+        else:
+            for name, cov, ok in zip(names, covs.tolist(), readable):
+                if ok:
+                    dictionary[name].setcoverage(cov)
+    if unmatched:
+        sys.stderr.write("ERROR: Contig names did not match on %d of %d lines"
+                         " in coverage file (first on line %d).\n" 
+                         %(unmatched[1], lineno, unmatched[0]))
+    if unreadable:
+        sys.stderr.write("ERROR: Could not read the coverage on %d of %d "
+                         "lines in coverage file (first on line %d).\n" 
+                         %(unreadable[1], lineno, unreadable[0]))
+    return dictionary
+
+
+
+
+
+def countline(counter, lineno):
+    """Count one more bad line in counter, a list [first line, count]."""
+    if counter:
+        counter[0] = min(counter[0], lineno)
+        counter[1] += 1
+    else:
+        counter.extend([lineno, 1])
+
+
+
+
+
+def tofloats(values):
+    """Convert a list of strings to a NumPy array of floats, all at once. 
+    Strings that are not numbers become 'nan'.
+    """
+    try:
+        return np.array(values, dtype = np.float64)
+    except ValueError: # Convert one at a time to find the bad values.
+        covs = np.empty(len(values))
+        for i, value in enumerate(values):
+            try:
+                covs[i] = float(value)
+            except ValueError:
+                covs[i] = np.nan
+        return covs
+
+
+
+
+
+def physical_memory():
+    """Return the size of the physical memory in bytes, or None if it is not
+    known.
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+
+
+
+class CoverageMatrix(object):
+    """The coverage of each contig in each of many samples: values is a 
+    float32 array with one row per contig of a ContigTable, in the same 
+    order, and one column per name in samples. Contigs without coverage 
+    have 'nan'. The summaries are calculated COV_BLOCK rows at a time, so 
+    they work on memory mapped matrices that do not fit in memory.
+    """
+    def __init__(self, samples, values):
+        self.samples = list(samples)
+        self.values = values
+
+    @classmethod
+    def empty(cls, samples, rows, memmap = None):
+        """Return a matrix of 'nan' for rows contigs. It is memory mapped to
+        the file memmap if that is given, or to a temporary file if the 
+        matrix would take more than half of the physical memory.
+        """
+        shape = (rows, len(samples))
+        memory = physical_memory()
+        if memmap is None and memory and rows * len(samples) * 4 > memory / 2:
+            handle, memmap = tempfile.mkstemp(suffix = '.covmatrix')
+            os.close(handle)
+            values = np.memmap(memmap, dtype = np.float32, mode = 'w+', 
+                               shape = shape)
+            os.remove(memmap) # The mapping keeps the data until it is closed.
+        elif memmap is not None:
+            values = np.memmap(memmap, dtype = np.float32, mode = 'w+', 
+                               shape = shape)
+        else:
+            values = np.empty(shape, dtype = np.float32)
+        values.fill(np.nan)
+        return cls(samples, values)
+
+    def sample(self, name):
+        """Return the coverage column of one sample as float64."""
+        return self.values[:, self.samples.index(name)].astype(np.float64)
+
+    def blocks(self):
+        for start in xrange(0, len(self.values), COV_BLOCK):
+            yield self.values[start:start + COV_BLOCK].astype(np.float64)
+
+    def mean(self):
+        """Return the mean coverage of each contig over the samples that 
+        have a value for it ('nan' if none has).
+        """
+        means = []
+        for block in self.blocks():
+            counts = (~np.isnan(block)).sum(axis = 1)
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                means.append(np.nansum(block, axis = 1) / counts)
+        return np.concatenate(means) if means else np.zeros(0)
+
+    def cv(self):
+        """Return the coefficient of variation (standard deviation / mean) 
+        of the coverage of each contig over the samples.
+        """
+        cvs = []
+        for block in self.blocks():
+            counts = (~np.isnan(block)).sum(axis = 1)
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                mean = np.nansum(block, axis = 1) / counts
+                squares = np.nansum((block - mean[:, np.newaxis]) ** 2, 
+                                    axis = 1)
+                cvs.append(np.sqrt(squares / counts) / mean)
+        return np.concatenate(cvs) if cvs else np.zeros(0)
+
+    def logratio(self, first, second, pseudocount = 1.0):
+        """Return log2((first + pseudocount) / (second + pseudocount)) of the
+        coverage of each contig in two samples.
+        """
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return np.log2((self.sample(first) + pseudocount) / 
+                           (self.sample(second) + pseudocount))
+
+
+
+
+
+def read_covmatrix(infile, table, memmap = None):
+    """Read a coverage matrix file, with a header line with the sample names
+    after the first column and then one line per contig with the name and 
+    the coverage in each sample, separated by tab. The arguments needed are
+    the file and a ContigTable; memmap is passed on to CoverageMatrix.empty.
+    The values of a block of COV_BLOCK lines are parsed with one call, after
+    each line has been checked to have one field per sample. Lines with 
+    unknown names or unreadable values are counted and reported once at the
+    end, as by read_covfile. Returns a CoverageMatrix.
+    """
+    infile.seek(0)
+    samples = infile.readline().rstrip('\r\n').split('\t')[1:]
+    matrix = CoverageMatrix.empty(samples, len(table), memmap)
+    rows = table.rows()
+    unmatched, unreadable = [], []
+    lineno = 1
+    while True:
+        lines = list(itertools.islice(infile, COV_BLOCK))
+        if not lines:
+            break
+        index, values, linenos = [], [], []
+        for line in lines:
+            lineno += 1
+            name, tab, fields = line.partition('\t')
+            if name not in rows:
+                countline(unmatched, lineno)
+            elif fields.count('\t') != len(samples) - 1:
+                countline(unreadable, lineno)
+            else:
+                index.append(rows[name])
+                values.append(fields)
+                linenos.append(lineno)
+        covs = np.fromstring(' '.join(values), dtype = np.float32, sep = ' ')
+        if len(covs) == len(values) * len(samples):
+            matrix.values[index] = covs.reshape(len(values), len(samples))
+            continue
+        for row, fields, number in zip(index, values, linenos): # Find the 
+            covs = tofloats(fields.split('\t'))                 # bad lines.
+            if np.isnan(covs).any() and \
+               'nan' not in fields.lower():
+                countline(unreadable, number)
+            matrix.values[row] = covs
+    if unmatched:
+        sys.stderr.write("ERROR: Contig names did not match on %d of %d lines"
+                         " in coverage matrix (first on line %d).\n" 
+                         %(unmatched[1], lineno - 1, unmatched[0]))
+    if unreadable:
+        sys.stderr.write("ERROR: Could not read the coverage on %d of %d "
+                         "lines in coverage matrix (first on line %d).\n" 
+                         %(unreadable[1], lineno - 1, unreadable[0]))
+    return matrix
+
+
+
+
+
+def write_matrixstats(outfile, table, matrix, ratios = ()):
+    """Write the mean and coefficient of variation of the coverage over the
+    samples of a CoverageMatrix for each contig, and the log2 ratio of the 
+    coverage for each pair (first, second) of samples in ratios, separated 
+    by tab and with a header line.
+    """
+    columns = [table.name.tolist(), matrix.mean().tolist(), 
+               matrix.cv().tolist()]
+    header = ['name', 'mean', 'cv']
+    for first, second in ratios:
+        header.append('log2(%s/%s)' %(first, second))
+        columns.append(matrix.logratio(first, second).tolist())
+    row = '\t'.join(['%s'] * len(columns)) + '\n'
+    outfile.write('\t'.join(header) + '\n')
+    for start in xrange(0, len(table), TABLE_BLOCK):
+        outfile.write(''.join([row % fields for fields in 
+                               zip(*[column[start:start + TABLE_BLOCK] 
+                                     for column in columns])]))
+
+
+
+
+
+def read_depthfile(infile, contigs, statistic = 'mean'):
+    """Calculate the coverage of each contig from a per-base depth file with
+    the columns name, position and depth (as written by samtools depth). The
+    arguments needed are the depth file, a ContigTable or a dictionary where
+    the item is an object of the class Fasta, and which of 'mean' or 
+    'median' becomes the coverage of the contigs. Positions missing from the
+    file count as depth 0.
+
+    The file is read in pieces of DEPTH_CHUNK bytes and the lines of each 
+    contig in a piece are summed with NumPy. The median is taken from a 
+    histogram of the depths of the current contig, so memory use depends on
+    the highest depth, not on the number of lines. This needs the lines of a
+    contig to come together, as they do from samtools depth; contigs whose 
+    lines are split up get no median. Returns arrays with the mean, median 
+    and covered fraction, in the order of the ContigTable.
+    """
+    table = as_table(contigs)
+    rows = table.rows()
+    total = np.zeros(len(table))
+    covered = np.zeros(len(table), dtype = np.int64)
+    seen = np.zeros(len(table), dtype = np.int64)
+    median = np.zeros(len(table))
+    done = np.zeros(len(table), dtype = bool)
+    unmatched, split = [0, 0], set() # Unknown lines, split contigs.
+    current, histogram = None, None
+    lineno = 0
+    infile.seek(0)
+    for chunk in iter_chunks(infile):
+        fields = chunk.split()
+        if len(fields) % 3:
+            sys.stderr.write("ERROR: The depth file must have three columns "
+                             "(name, position and depth).\n")
+            break
+        names = np.array(fields[0::3], dtype = object)
+        try:
+            depths = np.array(fields[2::3]).astype(np.int64)
+        except ValueError:
+            sys.stderr.write("ERROR: Could not read the depths in depth file "
+                             "after line %d.\n" % lineno)
+            break
+        del fields
+        starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]])
+        ends = np.r_[starts[1:], len(names)]
+        sums = np.add.reduceat(depths, starts)
+        nonzero = np.add.reduceat((depths > 0).astype(np.int64), starts)
+        for start, end, depthsum, depthcount in zip(starts, ends, sums, 
+                                                    nonzero):
+            row = rows.get(names[start])
+            if row is None:
+                unmatched[0] = unmatched[0] or lineno + start + 1
+                unmatched[1] += end - start
+                continue
+            if row != current:
+                if current is not None:
+                    median[current] = histmedian(histogram, 
+                                                 table.length[current] - 
+                                                 seen[current])
+                    done[current] = True
+                if done[row]:
+                    split.add(row)
+                current, histogram = row, np.zeros(0, dtype = np.int64)
+            counts = np.bincount(depths[start:end])
+            if len(counts) > len(histogram):
+                counts[:len(histogram)] += histogram
+                histogram = counts
+            else:
+                histogram[:len(counts)] += counts
+            total[row] += depthsum
+            covered[row] += depthcount
+            seen[row] += end - start
+        lineno += len(names)
+    if current is not None:
+        median[current] = histmedian(histogram, 
+                                     table.length[current] - seen[current])
+    median[list(split)] = np.nan
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        length = np.where(table.length > 0, table.length, np.nan)
+        mean = total / length
+        fraction = covered / length
+    median[np.isnan(length)] = np.nan
+    if unmatched[1]:
+        sys.stderr.write("ERROR: Contig names did not match on %d of %d lines"
+                         " in depth file (first on line %d).\n" 
+                         %(unmatched[1], lineno, unmatched[0]))
+    if split:
+        sys.stderr.write("ERROR: The lines of %d contigs are not together in "
+                         "depth file, their median coverage is 'nan'.\n" 
+                         % len(split))
+    coverage = mean if statistic == 'mean' else median
+    if contigs is table:
+        table.coverage[:] = coverage
+    else:
+        for name, cov in zip(table.name, coverage.tolist()):
+            contigs[name].setcoverage(cov)
+    return mean, median, fraction
+
+
+
+
+
+def histmedian(histogram, zeros = 0):
+    """Return the median of the values counted in histogram, where 
+    histogram[i] is the number of values equal to i, and zeros is the number
+    of extra values equal to 0.
+    """
+    histogram = histogram.copy() if len(histogram) else np.zeros(1, np.int64)
+    histogram[0] += max(zeros, 0)
+    total = histogram.sum()
+    if total == 0:
+        return np.nan
+    cumulative = np.cumsum(histogram)
+    low = np.searchsorted(cumulative, (total - 1) // 2, side = 'right')
+    high = np.searchsorted(cumulative, total // 2, side = 'right')
+    return (low + high) / 2.0
+
+
+
+
+
+def iter_records(infile):
+    """Read fasta file one sequence at a time. The argument needed is a fasta 
+    file. Yields one object of the class Fasta per sequence, so only one 
+    sequence is kept in memory at a time.
+    """
+    infile.seek(0)
+    return parse_records(infile)
+
+
+
+
+
+def parse_records(lines):
+    """Yield one object of the class Fasta per sequence in lines, which can 
+    be a fasta file or any other iterable over the lines of one.
+    """
+    name, seq = None, []
+    for line in lines:
+        if line.startswith('>'):
+            if name:
+                yield Fasta(name, ''.join(seq))
+            name, seq = line, []
+        else:
+            seq.append(line)
+    if name:
+        yield Fasta(name, ''.join(seq))
+
+
+
+
+
+def iter_stats(infile):
+    """Read fasta file one sequence at a time and yield an object of the 
+    class ContigStats for each sequence. The sequence is dropped as soon as 
+    its statistics have been calculated. The argument needed is a fasta file.
+    """
+    for fs in iter_records(infile):
+        yield fs.stats()
+
+
+
+
+
+def read_stats(infile):
+    """Read fasta file and return a dictionary where the item is an object 
+    of the class ContigStats and the key is the name of the contig. Memory 
+    use is bounded by the largest contig, not the whole file. The argument 
+    needed is a fasta file.
+    """
+    dictionary = {}
+    for stats in iter_stats(infile):
+        dictionary[stats.header()] = stats
+    return dictionary
+
+
+
+
+
+def read_file(infile, packed = False):
+    """Read fasta file. The argument needed is a fasta file. With packed = 
+    True, each sequence is stored as a PackedSequence as soon as it is read,
+    so the whole file takes about a quarter of the memory.
+    """
+    dictionary = {}
+    for fs in iter_records(infile):
+        if packed:
+            fs.pack()
+        dictionary[fs.header()] = fs
+    return dictionary
+
+
+
+
+
+def indexname(name):
+    """Return the first word of a contig name, which is the name used in a 
+    .fai index (as in samtools).
+    """
+    return (name.split() or [''])[0]
+
+
+
+
+
+def build_index(path):
+    """Write a samtools compatible index of a fasta file to path + '.fai', 
+    with one line per sequence: name, length, offset of the first base, 
+    bases per line and bytes per line. The argument needed is the path to 
+    the fasta file. Returns the index as an object of the class FastaIndex,
+    also if the .fai file can't be written. Raises ValueError if the lines 
+    of a sequence are not all of the same length.
+    """
+    index = FastaIndex()
+    name = None
+    offset = 0
+    with open(path, 'rb') as infile:
+        for line in infile:
+            if line.startswith('>'):
+                if name is not None:
+                    index.add(name, length, start, linebases, linewidth)
+                name = indexname(line[1:])
+                length, linebases, linewidth, last = 0, 0, 0, False
+                start = offset + len(line)
+            elif name is not None:
+                bases = len(line.rstrip('\r\n'))
+                if bases:
+                    if last or (linebases and bases > linebases):
+                        raise ValueError("Different line length in sequence "
+                                         "%r, can't index %s." % (name, path))
+                    if not linebases:
+                        linebases, linewidth = bases, len(line)
+                    elif bases < linebases:
+                        last = True # Only the last line may be shorter.
+                    length += bases
+            offset += len(line)
+    if name is not None:
+        index.add(name, length, start, linebases, linewidth)
+    try:
+        index.write(path + '.fai')
+    except (IOError, OSError) as error:
+        sys.stderr.write("WARNING: Could not save the index to %s: %s\n" 
+                         %(path + '.fai', error))
+    return index
+
+
+
+
+
+class FastaIndex(object):
+    """The contents of a .fai file. For each sequence name, entries holds 
+    the tuple (length, offset, line bases, line width).
+    """
+    def __init__(self):
+        self.names = []
+        self.entries = {}
+
+    def add(self, name, length, offset, linebases, linewidth):
+        self.names.append(name)
+        self.entries[name] = (length, offset, linebases, linewidth)
+
+    @classmethod
+    def read(cls, path):
+        index = cls()
+        with open(path) as infile:
+            for line in infile:
+                fields = line.rstrip('\n').split('\t')
+                index.add(fields[0], *[int(field) for field in fields[1:5]])
+        return index
+
+    def write(self, path):
+        with open(path, 'w') as outfile:
+            for name in self.names:
+                outfile.write('%s\t%d\t%d\t%d\t%d\n' 
+                              %((name,) + self.entries[name]))
+
+
+
+
+
+class IndexedFasta(object):
+    """Random access to the sequences of a fasta file through its .fai index.
+    The file is memory mapped, so fetching a sequence only reads the part of
+    the file that holds it. The index is built if it is missing or older 
+    than the fasta file.
+    """
+    def __init__(self, path):
+        fai = path + '.fai'
+        if os.path.exists(fai) and \
+           os.path.getmtime(fai) >= os.path.getmtime(path):
+            self.index = FastaIndex.read(fai)
+        else:
+            self.index = build_index(path)
+        self.file = open(path, 'rb')
+        if os.path.getsize(path) == 0:
+            self.data = '' # Empty files can't be memory mapped.
+        else:
+            self.data = mmap.mmap(self.file.fileno(), 0, 
+                                  access = mmap.ACCESS_READ)
+
+    def __contains__(self, name):
+        return indexname(name) in self.index.entries
+
+    def fetch(self, name, start = 0, end = None):
+        """Return bases start to end (0-based, end not included) of the 
+        sequence, in lower case and without line breaks. The name can be 
+        the full contig header or only its first word.
+        """
+        length, offset, linebases, linewidth = \
+            self.index.entries[indexname(name)]
+        if end is None or end > length:
+            end = length
+        start = max(0, start)
+        if start >= end:
+            return ''
+        first = offset + start // linebases * linewidth + start % linebases
+        last = offset + (end - 1) // linebases * linewidth + \
+               (end - 1) % linebases + 1
+        return self.data[first:last].translate(None, '\r\n').lower()
+
+    def record(self, name):
+        """Return the whole sequence as an object of the class Fasta."""
+        return Fasta('>' + name, self.fetch(name))
+
+    def close(self):
+        if self.data:
+            self.data.close()
+        self.file.close()
+
+
+
+
+
+def parse_region(region):
+    """Split a samtools style region, 'name', 'name:start' or 
+    'name:start-end' with 1-based positions, into the name and the 0-based 
+    start and end used by IndexedFasta.fetch.
+    """
+    name, colon, interval = region.rpartition(':')
+    if not colon:
+        return region, 0, None
+    start, dash, end = interval.replace(',', '').partition('-')
+    try:
+        return name, int(start) - 1, int(end) if end else None
+    except ValueError: # The colon is part of the name.
+        return region, 0, None
+
+
+
+
+
+def print_regions(path, regions):
+    """Print regions of a fasta file in fasta format, using the index so that
+    the rest of the file is not read. The arguments needed are the path to 
+    the fasta file and a list of regions ('name' or 'name:start-end').
+    """
+    try:
+        fasta = IndexedFasta(path)
+    except (IOError, ValueError) as error:
+        sys.stderr.write("ERROR: %s\n" % error)
+        return
+    for region in regions:
+        name, start, end = parse_region(region)
+        if name not in fasta:
+            sys.stderr.write("ERROR: Contig %r not found in %s.\n" 
+                             %(name, path))
+            continue
+        seq = fasta.fetch(name, start, end)
+        print '>' + region
+        for i in xrange(0, len(seq), 60):
+            print seq[i:i + 60]
+    fasta.close()
+
+
+
+
+
+def read_names(infile):
+    """Return the set of contig names in a file with one name per line, such 
+    as a list of names for --names or --exclude. Only the first word of each
+    line is used, and a leading '>' is removed.
+    """
+    names = set()
+    for line in infile:
+        words = line.lstrip('>').split()
+        if words:
+            names.add(words[0])
+    return names
+
+
+
+
+
+def read_coverage(infile):
+    """Read a coverage file into a dictionary where the item is the coverage 
+    and the key is the name of the contig, without the fasta file. Used to 
+    filter contigs on their coverage before their sequences are read.
+    """
+    infile.seek(0)
+    names, values = [], []
+    for line in infile:
+        fields = line.split('\t')
+        if len(fields) >= 2:
+            names.append(fields[0])
+            values.append(fields[1])
+    return dict(zip(names, tofloats(values).tolist()))
+
+
+
+
+
+class RecordFilter(object):
+    """The conditions a contig must meet to be written by filter_fasta: at 
+    least min_length bases, GC content (%) within gc_range (low, high), at 
+    least min_coverage in the dictionary coverage, a name in names and not 
+    in exclude (full names or first words). Conditions that are None are not
+    checked. The conditions on the name and coverage only need the header, 
+    so they are checked first and the sequence is not read for contigs that
+    fail them.
+    """
+    def __init__(self, min_length = None, gc_range = None, 
+                 min_coverage = None, coverage = None, names = None, 
+                 exclude = None):
+        self.min_length = min_length or 0
+        self.gc_range = gc_range
+        self.min_coverage = min_coverage
+        self.coverage = coverage or {}
+        self.names = names
+        self.exclude = exclude
+
+    def needs_counts(self):
+        """Tests if the bases of a contig must be counted to decide on it."""
+        return self.min_length > 0 or self.gc_range is not None
+
+    def keep_name(self, name):
+        """Tests the conditions on the name and coverage of a contig. The 
+        argument needed is the contig name (the header minus the '>').
+        """
+        first = indexname(name)
+        if self.names is not None and name not in self.names and \
+           first not in self.names:
+            return False
+        if self.exclude and (name in self.exclude or first in self.exclude):
+            return False
+        if self.min_coverage is not None:
+            cov = self.coverage.get(name, self.coverage.get(first))
+            if cov is None or not cov >= self.min_coverage: # Also nan.
+                return False
+        return True
+
+    def keep_counts(self, counts):
+        """Tests the conditions on the length and GC content of a contig. The
+        argument needed is the tuple from basecount.
+        """
+        a, c, g, t, n, other = counts
+        if sum(counts) < self.min_length:
+            return False
+        if self.gc_range is not None:
+            gc = gcpercent(g + c, a + c + g + t)
+            if not self.gc_range[0] <= gc <= self.gc_range[1]:
+                return False
+        return True
+
+
+
+
 
+def filter_fasta(infile, outfile, keep):
+    """Write the contigs of a fasta file that meet the conditions of keep, 
+    an object of the class RecordFilter, to outfile. Each passing record is 
+    copied unchanged, header, line breaks and all. Returns the number of 
+    contigs written and the number read. An uncompressed file is mapped into
+    memory: the bases of each record are counted in place, and runs of 
+    passing records are written with one copy of up to FILTER_BLOCK bytes. 
+    Other files are read line by line, and the lines of a contig are only 
+    kept if its header passes.
+    """
+    if not isplainfile(infile):
+        return filter_lines(infile, outfile, keep)
+    kept, total = 0, 0
+    if os.path.getsize(infile.name) == 0:
+        return kept, total
+    data = mmap.mmap(infile.fileno(), 0, access = mmap.ACCESS_READ)
+    try:
+        size = len(data)
+        run_start = run_end = 0 # The passing bytes not written yet.
+        start = 0 if data[:1] == '>' else data.find('\n>') + 1
+        while start or data[:1] == '>':
+            end = data.find('\n>', start) + 1 or size
+            eol = data.find('\n', start, end)
+            eol = end if eol == -1 else eol + 1
+            total += 1
+            passed = keep.keep_name(data[start + 1:eol].rstrip())
+            if passed and keep.needs_counts():
+                passed = end - eol >= keep.min_length and keep.keep_counts(
+                    basecount(buffer(data, eol, end - eol))) # No copy.
+            if passed:
+                kept += 1
+                if start != run_end or run_end - run_start >= FILTER_BLOCK:
+                    outfile.write(data[run_start:run_end])
+                    run_start = start
+                run_end = end
+            if end == size:
+                break
+            start = end
+        outfile.write(data[run_start:run_end])
+    finally:
+        data.close()
+    return kept, total
+
+
+
+
+
+def filter_lines(infile, outfile, keep):
+    """Write the contigs that meet the conditions of keep from a fasta file 
+    that can only be read line by line (stdin or compressed), for 
+    filter_fasta. Returns the number of contigs written and the number read.
+    """
+    kept, total = 0, 0
+    header, lines = None, None # lines is None while a contig is skipped.
+    for line in itertools.chain(infile, ['>']):
+        if line.startswith('>'):
+            if lines is not None:
+                record = ''.join(lines)
+                if not keep.needs_counts() or keep.keep_counts(
+                        basecount(record)):
+                    outfile.write(header)
+                    outfile.write(record)
+                    kept += 1
+            if line == '>':
+                break
+            total += 1
+            header = line
+            lines = [] if keep.keep_name(line[1:].rstrip()) else None
+        elif lines is not None:
+            lines.append(line)
+    return kept, total
+
+
+
+
+
+def chunk_ranges(path, chunks):
+    """Split a fasta file into at most the given number of byte ranges of 
+    about the same size, each starting at a '>'. Returns a list of (start, 
+    end) tuples that together cover the whole file.
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    bounds = [0]
+    with open(path, 'rb') as infile:
+        data = mmap.mmap(infile.fileno(), 0, access = mmap.ACCESS_READ)
+        for i in range(1, chunks):
+            pos = data.find('\n>', max(size * i // chunks, bounds[-1], 1) - 1)
+            if pos == -1:
+                break
+            if pos + 1 > bounds[-1]:
+                bounds.append(pos + 1)
+        data.close()
+    bounds.append(size)
+    return zip(bounds[:-1], bounds[1:])
+
+
+
+
+
+def read_range(infile, start, end):
+    """Yield the lines of an open file from byte start up to byte end."""
+    infile.seek(start)
+    left = end - start
+    for line in infile:
+        if left <= 0:
+            break
+        left -= len(line)
+        yield line
 
 
 
 
-LENGTH_LARGE = 100000
-LENGTH_SMALL = 10000
-GC_LARGE = 55
-GC_SMALL = 40
-mark = None
-annotation = None
 
+def range_stats(job):
+    """Calculate length, GC content and N content for the sequences in one 
+    byte range of a fasta file. Run in a worker process by parallel_stats. 
+    The argument needed is a tuple (path, start, end). Only the names and 
+    NumPy arrays with the statistics are sent back, not the sequences.
+    """
+    path, start, end = job
+    name, length, gc, n_count = [], [], [], []
+    with open(path, 'rb') as infile:
+        for fs in parse_records(read_range(infile, start, end)):
+            name.append(fs.header())
+            length.append(fs.length())
+            gc.append(fs.gccount())
+            n_count.append(fs.ncontent())
+    return name, np.array(length, dtype = np.int64), \
+           np.array(gc, dtype = np.float64), np.array(n_count, dtype = np.int64)
 
 
 
 
-class Fasta(object):
-    """Each sequence becomes one object of the class Fasta. 
+
+def parallel_stats(path, threads):
+    """Calculate the statistics of a fasta file in several processes, each 
+    reading its own part of the file. The arguments needed are the path to 
+    the fasta file and the number of processes. Returns a ContigTable with 
+    the contigs in the same order as in the file.
     """
-    def __init__(self, name, seq):
-        self.name = name[1:].rstrip() # The name equals the contig header minus the '>'.
-        self.seq = seq.lower()
-        self.cov = float('nan')	# For missing coverage values, 
-                                # covgcplot will not plot.
+    jobs = [(path, start, end) for start, end 
+            in chunk_ranges(path, threads * 4)] # More parts than processes, 
+                                                # so that they finish together.
+    pool = multiprocessing.Pool(threads)
+    try:
+        parts = pool.map(range_stats, jobs, chunksize = 1)
+    finally:
+        pool.close()
+        pool.join()
+    if not parts:
+        return ContigTable([], [], [], [])
+    return ContigTable([name for part in parts for name in part[0]],
+                       *[np.concatenate([part[i] for part in parts]) 
+                         for i in (1, 2, 3)])
 
-    def header(self):
-        return self.name
 
-    def sequence(self):
-        return self.seq
 
-    def length(self):
-        return len(self.seq) - self.seq.count('\n')
 
-    # Calculates the number of G and C relative to the 
-    # total number of G, C, A and T.
-    def gccount(self):
-        self.gc = self.seq.count("g") + self.seq.count("c")
-        self.total = self.seq.count("g") + self.seq.count("c") + \
-                     self.seq.count("a") + self.seq.count("t")
-        if self.total == 0:
-            self.content = float('nan')
-        else:
-            self.content = round((float(self.gc) / self.total) * 100, 1)
-        return self.content
 
-    def getcoverage(self):
-        return self.cov
+def fingerprint(path, size = 1 << 16):
+    """Return a SHA-1 hex digest of the first and last size bytes of a 
+    file, which is cheap to calculate even for very large files.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as infile:
+        digest.update(infile.read(size))
+        infile.seek(max(0, os.path.getsize(path) - size))
+        digest.update(infile.read(size))
+    return digest.hexdigest()
 
-    def setcoverage(self, cov):
-        self.cov = cov
 
-    def ncontent(self):
-        return self.seq.count("n")
 
 
 
+def cachekey(path):
+    """Return what a cached table is checked against: the absolute path, 
+    size, modification time and fingerprint of the fasta file.
+    """
+    info = os.stat(path)
+    return (os.path.abspath(path), info.st_size, info.st_mtime, 
+            fingerprint(path))
+
+
 
 
-class conname(object):
-    """Store the contig name so that it is easily available to the onpick and 
-    format_coord functions."""
-    def __init__(self, name):
-        self.name = name
 
+def save_cache(path, table):
+    """Save the length, GC content and N content of each contig of a fasta 
+    file to path + '.stats.npz', next to the fasta file. The arguments 
+    needed are the path to the fasta file and its ContigTable.
+    """
+    key = cachekey(path)
+    tmp = '%s.stats.%d.tmp' %(path, os.getpid())
+    try:
+        with open(tmp, 'wb') as outfile:
+            np.savez(outfile, path = key[0], size = key[1], mtime = key[2], 
+                     fingerprint = key[3], 
+                     name = np.array(table.name.tolist(), dtype = str), 
+                     length = table.length, gc = table.gc, 
+                     n_count = table.n_count)
+        os.rename(tmp, path + '.stats.npz') # Readers never see half a file.
+    except (IOError, OSError) as error:
+        sys.stderr.write("WARNING: Could not save statistics to %s: %s\n" 
+                         %(path + '.stats.npz', error))
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+
+
+
+def load_cache(path):
+    """Load the ContigTable saved by save_cache for a fasta file. Returns 
+    None if there is no saved table or if the fasta file has changed since 
+    it was saved. The argument needed is the path to the fasta file.
+    """
+    try:
+        with open(path + '.stats.npz', 'rb') as infile:
+            cached = np.load(infile)
+            key = (cached['path'].item(), cached['size'].item(), 
+                   cached['mtime'].item(), cached['fingerprint'].item())
+            if key != cachekey(path):
+                return None
+            return ContigTable(cached['name'].astype(object), cached['length'],
+                               cached['gc'], cached['n_count'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None
 
 
 
 
-def read_covfile(infile, dictionary):
-    """Read coverage file and add coverage for each contig to the dictionary.
-    The arguments needed are a fasta file and a dictionary where the item is
-    an object of the class Fasta and the key is the name of the contig.
+
+def read_table(infile, threads = 1, cache = False):
+    """Read a fasta file and return a ContigTable with the statistics of all
+    contigs. The arguments needed are the fasta file, the number of 
+    processes to read it with (parallel_stats is used when it is more than 1
+    and the file is uncompressed) and whether the statistics should be 
+    loaded from and saved to the cache file next to the fasta file.
     """
-    infile.seek(0)
-    i = 0
-    for line in infile:
-        i = i + 1
-        name, cov = line.split('\t')
-        if name in dictionary.keys():
-            try:
-                dictionary[name].setcoverage(float(cov))
-            except:
-                pass
-        else:
-            sys.stderr.write("ERROR: Contig names did not match, line %r in coverage file. \n" % i)
-    return dictionary
+    path = getattr(infile, 'name', None)
+    cache = cache and infile is not sys.stdin and os.path.isfile(path)
+    if cache:
+        table = load_cache(path)
+        if table is not None:
+            return table
+    if threads > 1 and isplainfile(infile):
+        table = parallel_stats(path, threads)
+    else: # The sequences are not kept, only their statistics.
+        table = ContigTable.from_records(iter_stats(infile))
+    if cache:
+        save_cache(path, table)
+    return table
+
+
+
+
+
+class LogHistogram(object):
+    """Counts of values in fixed bins, by default the log spaced bins 
+    HISTOGRAM_BINS. Only the counts are kept, so the memory used does not 
+    grow with the number of values. Values are added in batches with add, 
+    and histograms with the same bins (from other parts of a file, other 
+    processes or other assemblies) are added together with merge or +. As 
+    in np.histogram, each bin includes its lower edge and the last bin also 
+    its upper edge. Values outside the bins and nan are counted in under, 
+    over and missing.
+    """
+    def __init__(self, bins = None):
+        if bins is None:
+            bins = HISTOGRAM_BINS
+        self.bins = np.asarray(bins, dtype = np.float64)
+        self.counts = np.zeros(len(self.bins) - 1, dtype = np.int64)
+        self.under = 0
+        self.over = 0
+        self.missing = 0
+
+    def add(self, values):
+        """Count a sequence or NumPy array of values. Returns the histogram.
+        """
+        values = np.asarray(values, dtype = np.float64).ravel()
+        size = len(self.counts)
+        for start in xrange(0, len(values), HISTOGRAM_BLOCK):
+            block = values[start:start + HISTOGRAM_BLOCK]
+            index = np.searchsorted(self.bins, block, side = 'right') - 1
+            index[block == self.bins[-1]] = size - 1
+            under = int((index < 0).sum())
+            missing = int(np.isnan(block).sum()) # Sorted after the last bin.
+            inside = index[(index >= 0) & (index < size)]
+            self.counts += np.bincount(inside, minlength = size)
+            self.under += under
+            self.over += len(block) - len(inside) - under - missing
+            self.missing += missing
+        return self
+
+    def merge(self, other):
+        """Add the counts of another LogHistogram with the same bins. 
+        Returns the histogram.
+        """
+        if not np.array_equal(self.bins, other.bins):
+            raise ValueError("Can't merge histograms with different bins.")
+        self.counts += other.counts
+        self.under += other.under
+        self.over += other.over
+        self.missing += other.missing
+        return self
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def copy(self):
+        histogram = LogHistogram(self.bins)
+        return histogram.merge(self)
+
+    def total(self):
+        """Return the number of values added, including those not in a bin.
+        """
+        return int(self.counts.sum()) + self.under + self.over + self.missing
+
+    def todict(self):
+        """Return the bins and counts as a dictionary of lists and numbers, 
+        which can be written as JSON.
+        """
+        return collections.OrderedDict([('bins', self.bins.tolist()), 
+                                        ('counts', self.counts.tolist()), 
+                                        ('under', self.under), 
+                                        ('over', self.over), 
+                                        ('missing', self.missing)])
+
+    @classmethod
+    def fromdict(cls, dictionary):
+        """Return the LogHistogram of a dictionary from todict."""
+        histogram = cls(dictionary['bins'])
+        histogram.counts += np.asarray(dictionary['counts'], dtype = np.int64)
+        histogram.under = dictionary['under']
+        histogram.over = dictionary['over']
+        histogram.missing = dictionary['missing']
+        return histogram
+
+    def write_text(self, outfile):
+        """Write the lower edge, upper edge and count of each bin, separated
+        by tab, one bin per line.
+        """
+        outfile.write('low\thigh\tcount\n')
+        outfile.write(''.join(['%r\t%r\t%d\n' % row for row 
+                               in zip(self.bins[:-1].tolist(), 
+                                      self.bins[1:].tolist(), 
+                                      self.counts.tolist())]))
 
 
 
 
 
-def read_file(infile):
-    """Read fasta file. The argument needed is a fasta file.
+def write_histograms(outfile, histograms):
+    """Write named histograms, a dictionary where the item is a LogHistogram
+    and the key is its name, to outfile as JSON.
     """
-    dictionary = {} 
-    infile.seek(0)
-    name, seq = None, []
-    for line in infile:
-        if line.startswith('>'):
-            if name:
-                fs = Fasta(name, ''.join(seq))
-                dict2 = {fs.header() : fs}
-                dictionary.update(dict2)
-            name, seq = line, []
-        else:
-            seq.append(line)
-    if name:
-        fs = Fasta(name, ''.join(seq))
-        dict2 = {fs.header() : fs}
-        dictionary.update(dict2)
-    return dictionary
+    json.dump(collections.OrderedDict([(name, histogram.todict()) for name, 
+                                       histogram in histograms.iteritems()]),
+              outfile, indent = 1)
+    outfile.write('\n')
 
 
 
 
 
-def lengcplot(dictionary):
-    """Plot GC content against length. The argument needed is a dictionary 
-    where the item is an object of the class Fasta and the key is the name 
-    of the contig.
+def read_histograms(infile):
+    """Read the histograms written by write_histograms. Returns a 
+    dictionary where the item is a LogHistogram and the key is its name.
     """
-    contig = conname(None)
-    xlist = []
-    ylist = []
-    namelist = []
-    for key in dictionary:
-        xlist.append(dictionary[key].length())
-        ylist.append(dictionary[key].gccount())
-        namelist.append(dictionary[key].header())
-
-    def onpick(event):
-        global annotation
-        global mark
-        if mark != None: 
-            try:
-                ax.lines.remove(mark)
-                annotation.remove()
-            except:
-                pass
-        """ Print the contig name for the chosen data point. But for cases where
-        two or more data points are chosen because they are close together in 
-        the plot, it only prints one. But that is less of a problem now that 
-        the picking tolerance is set to a very low value (0.5).
-        """
-        ind = event.ind
-        contigname = namelist[int(ind[0])]
-        contig.name = contigname
-        contig_info = "%s \n Length: %r \n GC: %r \n Coverage: %r \n N: %r" \
-                      %(contig.name, dictionary[contig.name].length(), 
-                      dictionary[contig.name].gccount(), 
-                      dictionary[contig.name].getcoverage(), 
-                      dictionary[contig.name].ncontent())
-        mark, = ax.plot(xlist[ind[0]], ylist[ind[0]], color = 'r', marker = 'o')
-        annotation = ax.text(0.8, 0.15, contig_info, 
-                             horizontalalignment='center', 
-                             verticalalignment='center', 
-                             transform = ax.transAxes)
-        def on_key(event):
-            global annotation
-            global mark
-            if event.key == 'control':
-                try:
-                    annotation.remove()
-                    ax.lines.remove(mark)
-                    fig.canvas.draw()
-                except: 
-                    pass
-            else:
-                pass
+    return collections.OrderedDict([(name, LogHistogram.fromdict(dictionary))
+                                    for name, dictionary in json.load(
+                                        infile, object_pairs_hook = 
+                                        collections.OrderedDict).iteritems()])
 
-        cid = fig.canvas.mpl_connect('key_press_event', on_key)
-        fig.canvas.draw()
 
-    def format_coord(x, y):
-        """ format_coord shows contig.name (if any) in the lower right corner
-        of the plot, where x and y coordinates are shown. However, as it is now,
-        the cursor needs to be moved slightly before the text is updated with 
-        the new contigname..
+
+
+
+def table_histograms(table):
+    """Return the histograms of the length, GC content and (if there is 
+    any) coverage of the contigs of a ContigTable, for write_histograms.
+    """
+    histograms = collections.OrderedDict([
+        ('length', LogHistogram().add(table.length)), 
+        ('gc', LogHistogram(GC_BINS).add(table.gc))])
+    if table.covered().any():
+        histograms['coverage'] = LogHistogram().add(table.coverage)
+    return histograms
+
+
+
+
+
+class Follower(object):
+    """Statistics of a fasta file that is still being written. Each call to
+    update reads only what was appended since the last one, in pieces of 
+    FOLLOW_CHUNK bytes, and adds the complete records to the statistics: 
+    a list of ContigTables (one per piece), the length and GC histograms 
+    and the lengths for the summary as a few sorted runs, each at least 
+    twice as long as the next, so that adding lengths costs in proportion 
+    to the new ones. save also only appends the new rows to the checkpoint. 
+    table and summary put everything together when they are called. The 
+    checkpoint is the offset of the first byte not yet read and the 
+    partial record after the last complete one: a record is complete when 
+    the next one has started. table, histograms and summary include the 
+    partial record as it is so far. The argument needed is the fasta file, 
+    which must be an uncompressed file on disk.
+    """
+    def __init__(self, infile):
+        self.infile = infile
+        self.offset = 0
+        self.partial = ''
+        self.tables = []
+        self.lengths = [] # Sorted runs, see add.
+        self.length_histogram = LogHistogram()
+        self.gc_histogram = LogHistogram(GC_BINS)
+        self.saved = 0 # Tables already in the rows file of the checkpoint,
+        self.rows_size = 0 # and the size of that file.
+
+    def update(self):
+        """Read what was appended to the file since the last update and add 
+        the complete records to the statistics. Returns a ContigTable of 
+        the new complete records.
         """
-        if contig.name:
-            return 'x=%.4f, y=%.4f, name: %s'%(x, y, contig.name)
-        else:
-            return 'x=%.4f, y=%.4f'%(x, y)
+        self.infile.seek(self.offset)
+        pending = [self.partial] if self.partial else []
+        new = []
+        for piece in iter_chunks(self.infile, FOLLOW_CHUNK):
+            self.offset += len(piece)
+            # Pieces end with a line break, so only this piece can hold the 
+            # start of a new record.
+            cut = piece.rfind('\n>') + 1
+            if not cut and not (piece.startswith('>') and 
+                                (not pending or pending[-1].endswith('\n'))):
+                pending.append(piece)
+                continue
+            pending.append(piece[:cut])
+            table = ContigTable.from_records(record.stats() for record 
+                                             in parse_records(
+                                                 cStringIO.StringIO(''.join(
+                                                     pending))))
+            pending = [piece[cut:]]
+            if len(table):
+                self.add(table)
+                new.append(table)
+        self.partial = ''.join(pending)
+        return ContigTable.concatenate(new + [ContigTable([], [], [], [])])
+
+    def add(self, table):
+        """Add the rows of a ContigTable to the statistics."""
+        self.tables.append(table)
+        self.lengths.append(np.sort(table.length))
+        while len(self.lengths) > 1 and \
+              len(self.lengths[-2]) <= 2 * len(self.lengths[-1]):
+            last = self.lengths.pop()
+            self.lengths[-1] = self.merge(self.lengths[-1], last)
+        self.length_histogram.add(table.length)
+        self.gc_histogram.add(table.gc)
+
+    @staticmethod
+    def merge(lengths, new):
+        """Insert sorted new lengths into sorted lengths, keeping them sorted.
+        """
+        return np.insert(lengths, np.searchsorted(lengths, new), new)
 
+    def pending(self):
+        """Return the partial record as a ContigTable with 0 or 1 rows."""
+        return ContigTable.from_records(record.stats() for record 
+                                        in parse_records(
+                                            self.partial.splitlines(True)))
+
+    def table(self):
+        """Return a ContigTable of all records read so far."""
+        return ContigTable.concatenate(self.tables + [self.pending()])
+
+    def histograms(self):
+        """Return the counts of contigs in each bin of HISTOGRAM_BINS by 
+        length and in each bin of GC_BINS by GC content.
+        """
+        pending = self.pending()
+        return ((self.length_histogram + 
+                 LogHistogram().add(pending.length)).counts,
+                (self.gc_histogram + 
+                 LogHistogram(GC_BINS).add(pending.gc)).counts)
+
+    def summary(self, genome_size = None):
+        """Return assembly_summary of all records read so far."""
+        pending = self.pending()
+        lengths = np.sort(pending.length)
+        for run in self.lengths:
+            lengths = self.merge(run, lengths)
+        return assembly_summary(ContigTable.concatenate(self.tables + 
+                                                        [pending]), 
+                                genome_size, lengths)
+
+    def save(self, path):
+        """Save the checkpoint to path (a NumPy .npz file) and append the 
+        rows added since the last save to path + '.rows'. path.npz holds the
+        offset, the partial record, the histograms, the size of the rows 
+        file (anything after it is left from a save that did not finish) 
+        and a digest of the start of the file so that load can tell if the 
+        file was replaced. Always save a Follower to the same path.
+        """
+        with open(path + '.rows', 'r+b' if self.rows_size else 'wb') as rows:
+            rows.seek(self.rows_size)
+            rows.truncate()
+            for table in self.tables[self.saved:]:
+                for column in (np.array(table.name.tolist(), dtype = str), 
+                               table.length, table.gc, table.n_count):
+                    np.save(rows, column)
+            self.rows_size = rows.tell()
+        self.saved = len(self.tables)
+        tmp = '%s.%d.tmp' %(path, os.getpid())
+        with open(tmp, 'wb') as outfile:
+            np.savez(outfile, offset = self.offset, partial = self.partial, 
+                     head = self.head(), rows_size = self.rows_size, 
+                     histograms = json.dumps(
+                         [self.length_histogram.todict(), 
+                          self.gc_histogram.todict()]))
+        os.rename(tmp, path)
+
+    def head(self):
+        """SHA-1 hex digest of the part of the file that has been read, up 
+        to the first 64 kb.
+        """
+        self.infile.seek(0)
+        return hashlib.sha1(self.infile.read(min(self.offset, 1 << 16))
+                            ).hexdigest()
+
+    @classmethod
+    def load(cls, infile, path):
+        """Return a Follower for infile that continues from the checkpoint 
+        saved to path, or starts from the beginning if there is none or if
+        the file has been replaced or truncated since.
+        """
+        follower = cls(infile)
+        try:
+            with open(path, 'rb') as checkpoint:
+                saved = np.load(checkpoint)
+                follower.offset = saved['offset'].item()
+                if os.path.getsize(infile.name) < follower.offset or \
+                   follower.head() != saved['head'].item():
+                    return cls(infile)
+                follower.partial = saved['partial'].item()
+                follower.rows_size = saved['rows_size'].item()
+                follower.length_histogram, follower.gc_histogram = [
+                    LogHistogram.fromdict(histogram) for histogram 
+                    in json.loads(saved['histograms'].item())]
+            with open(path + '.rows', 'rb') as rows:
+                while rows.tell() < follower.rows_size:
+                    name, length, gc, n_count = [np.load(rows) 
+                                                 for i in range(4)]
+                    table = ContigTable(name.astype(object), length, gc, 
+                                        n_count)
+                    follower.tables.append(table)
+                    follower.lengths.append(np.sort(length))
+            follower.saved = len(follower.tables)
+            follower.lengths = [np.sort(np.concatenate(
+                follower.lengths + [np.zeros(0, dtype = np.int64)]))]
+        except (IOError, OSError, KeyError, ValueError):
+            return cls(infile)
+        return follower
+
+
+
+
+
+def follow(args, profiler):
+    """Read the infile with a Follower, continuing from args.checkpoint if 
+    it is given. With args.follow, read what is appended every args.follow 
+    seconds and print the summary whenever new contigs have been added, 
+    until interrupted (Ctrl-C). Returns the ContigTable of all contigs.
+    """
+    if args.checkpoint:
+        follower = Follower.load(args.infile, args.checkpoint)
+    else:
+        follower = Follower(args.infile)
+    try:
+        while True:
+            with profiler.stage('follow'):
+                new = follower.update()
+                if args.checkpoint:
+                    follower.save(args.checkpoint)
+            if args.follow is None:
+                break
+            if len(new):
+                sys.stdout.write('# %s: %d new contigs\n' 
+                                 %(time.strftime('%Y-%m-%d %H:%M:%S'), 
+                                   len(new)))
+                write_summary(sys.stdout, follower.summary(args.genomesize))
+                sys.stdout.flush()
+            time.sleep(args.follow)
+    except KeyboardInterrupt:
+        pass
+    return follower.table()
+
+
+
+
+
+def lengcplot(dictionary, outfile = None):
+    """Plot GC content against length. The argument needed is a ContigTable 
+    or a dictionary where the item is an object of the class Fasta and the 
+    key is the name of the contig. If outfile is given, the plot is 
+    saved to it instead of shown.
+    """
+    table = as_table(dictionary)
+    xlist = table.length
+    ylist = table.gc
+    namelist = table.name
     fig = plt.figure()
     ax = fig.add_subplot(111)
-    plt.scatter(xlist, ylist, picker=0.5) # Choose a higher picker value for
-                                          # higher tolerance when picking 
-                                          # points in the plot.
+    if len(xlist) > DENSITY_POINTS:
+        densityplot(ax, xlist, ylist, xlog = True)
+    else:
+        plt.scatter(xlist, ylist)
     plt.suptitle('GC - Length', fontsize = 20)
     plt.ylabel('GC content (%)')
     plt.xlabel('Length (nt)')
-    fig.canvas.mpl_connect('pick_event', onpick)
-    ax.format_coord = format_coord
-    plt.show()
-    return xlist, ylist, namelist
+    connect_picker(fig, ax, table, xlist, ylist, 'r')
+    showplot(fig, outfile)
+    return xlist.tolist(), ylist.tolist(), namelist.tolist()
 
 
 
 
 
-def covgcplot(dictionary):
-    """Plot GC content against coverage. The argument needed is a dictionary 
-    where the item is an object of the class Fasta and the key is the name 
-    of the contig.
+def covgcplot(dictionary, outfile = None, sample = None):
+    """Plot GC content against coverage. The argument needed is a ContigTable
+    or a dictionary where the item is an object of the class Fasta and the 
+    key is the name of the contig. If outfile is given, the plot is 
+    saved to it instead of shown. sample is shown in the title when the 
+    coverage is that of one sample of a CoverageMatrix.
     """
-    contig = conname(None)
-    namelist = []
-    xlist, xlist1, xlist2, xlist3 = [], [], [], []
-    ylist, ylist1, ylist2, ylist3 = [], [], [], []
-    for key in dictionary:
-        if isNaN(dictionary[key].getcoverage()) == False:
-            xlist.append(dictionary[key].getcoverage())
-            ylist.append(dictionary[key].gccount())
-            namelist.append(dictionary[key].header())
-            if dictionary[key].length() > LENGTH_LARGE:
-                xlist3.append(dictionary[key].getcoverage())
-                ylist3.append(dictionary[key].gccount())
-            elif LENGTH_SMALL <= dictionary[key].length() <= LENGTH_LARGE:
-                xlist2.append(dictionary[key].getcoverage())
-                ylist2.append(dictionary[key].gccount())
-            elif dictionary[key].length() < LENGTH_SMALL:
-                xlist1.append(dictionary[key].getcoverage())
-                ylist1.append(dictionary[key].gccount())
-            else:
-                pass
-    def onpick(event):
-        global annotation
-        global mark
-        if mark != None: 
-            try:
-                ax.lines.remove(mark)
-                annotation.remove()
-            except:
-                pass
-        ind = event.ind
-        contigname = namelist[int(ind[0])]
-        contig.name = contigname
-        contig_info = "%s \n Length: %r \n GC: %r \n Coverage: %r \n N: %r" \
-                      %(contig.name, dictionary[contig.name].length(), 
-                      dictionary[contig.name].gccount(), 
-                      dictionary[contig.name].getcoverage(), 
-                      dictionary[contig.name].ncontent())
-        mark, = ax.plot(xlist[ind[0]], ylist[ind[0]], color = 'r', marker = 'o')
-        annotation = ax.text(0.8, 0.15, contig_info, 
-                             horizontalalignment='center', 
-                             verticalalignment='center', 
-                             transform = ax.transAxes)
-        def on_key(event):
-            global annotation
-            global mark
-            if event.key == 'control':
-                try:
-                    annotation.remove()
-                    ax.lines.remove(mark)
-                    fig.canvas.draw()
-                except: 
-                    pass
-            else:
-                pass
-
-        cid = fig.canvas.mpl_connect('key_press_event', on_key)
-        fig.canvas.draw()
-
-    def format_coord(x, y):
-        if contig.name:
-            return 'x=%.4f, y=%.4f, name: %s'%(x, y, contig.name)
-        else:
-            return 'x=%.4f, y=%.4f'%(x, y)
-
+    table = as_table(dictionary)
+    table = table.take(table.covered()) # Contigs without coverage are not 
+                                        # plotted.
+    xlist, ylist, namelist = table.coverage, table.gc, table.name
+    small, medium, large = table.length_classes()
+    xlist1, xlist2, xlist3 = xlist[small], xlist[medium], xlist[large]
+    ylist1, ylist2, ylist3 = ylist[small], ylist[medium], ylist[large]
     fig = plt.figure()
     ax = fig.add_subplot(111)
-    fig.canvas.mpl_connect('pick_event', onpick)
-    ax.format_coord = format_coord
-    series = plt.scatter(xlist, ylist, marker = 'o', picker = 0.5, 
-                         facecolors = 'none', edgecolors = 'none')
-    series1 = plt.scatter(xlist1, ylist1, color = 'k', 
-                          marker = (5, 2, 0), label="< %s bp"%(LENGTH_SMALL))
-    series2 = plt.scatter(xlist2, ylist2, facecolors = 'none', 
-                          edgecolors = 'b', marker = 'o', 
-                          label="%s - %s bp" %(LENGTH_SMALL, LENGTH_LARGE))
-    series3 = plt.scatter(xlist3, ylist3, facecolors = 'none', 
-                          edgecolors = 'r', marker = 'o', 
-                          label="> %s bp" %(LENGTH_LARGE))
-    plt.suptitle('Coverage - GC', fontsize = 20)
+    connect_picker(fig, ax, table, xlist, ylist, 'r')
+    plt.suptitle('Coverage - GC' + (' - %s' % sample if sample else ''), 
+                 fontsize = 20)
     plt.ylabel('GC content (%)')
     plt.xlabel('Coverage')
-    leg = plt.legend(scatterpoints = 1)
-    leg.get_frame().set_alpha(0.5) # Transparent figure legend so that data
-                                   # hiding behind it will still be visible.
-    plt.show()
-    return xlist, xlist1, xlist2, xlist3, ylist, ylist1, ylist2, ylist3,\
-    namelist
+    if len(xlist) > DENSITY_POINTS: # No length classes in the density image.
+        densityplot(ax, xlist, ylist, xlog = True)
+    else:
+        series1 = plt.scatter(xlist1, ylist1, color = 'k', marker = (5, 2, 0),
+                              label="< %s bp"%(LENGTH_SMALL))
+        series2 = plt.scatter(xlist2, ylist2, facecolors = 'none', 
+                              edgecolors = 'b', marker = 'o', 
+                              label="%s - %s bp" %(LENGTH_SMALL, LENGTH_LARGE))
+        series3 = plt.scatter(xlist3, ylist3, facecolors = 'none', 
+                              edgecolors = 'r', marker = 'o', 
+                              label="> %s bp" %(LENGTH_LARGE))
+        leg = plt.legend(scatterpoints = 1)
+        leg.get_frame().set_alpha(0.5) # Transparent figure legend so that 
+                                       # data hiding behind it will still be
+                                       # visible.
+    showplot(fig, outfile)
+    return xlist.tolist(), xlist1.tolist(), xlist2.tolist(), \
+    xlist3.tolist(), ylist.tolist(), ylist1.tolist(), ylist2.tolist(), \
+    ylist3.tolist(), namelist.tolist()
+
+
+
+
+
+def covlenplot(dictionary, outfile = None):
+    """Plot coverage against length. The argument needed is a ContigTable or
+    a dictionary where the item is an object of the class Fasta and the key 
+    is the name of the contig. If outfile is given, the plot is 
+    saved to it instead of shown.
+    """
+    table = as_table(dictionary)
+    table = table.take(table.covered()) # Contigs without coverage are not 
+                                        # plotted.
+    xlist, ylist, namelist = table.coverage, table.length, table.name
+    small, medium, large = table.gc_classes()
+    xlist1, xlist2, xlist3 = xlist[small], xlist[medium], xlist[large]
+    ylist1, ylist2, ylist3 = ylist[small], ylist[medium], ylist[large]
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    connect_picker(fig, ax, table, xlist, ylist, 'c')
+    plt.suptitle('Length - Coverage', fontsize = 20)
+    plt.ylabel('Contig length')
+    plt.xlabel('Coverage')
+    if len(xlist) > DENSITY_POINTS: # No GC classes in the density image.
+        densityplot(ax, xlist, ylist, xlog = True, ylog = True)
+    else:
+        series1 = plt.scatter(xlist1, ylist1, color = 'k', 
+                              marker = 'o', label="< %r %%" %(GC_SMALL))
+        series2 = plt.scatter(xlist2, ylist2, color = 'b', marker = 'o', 
+                              label=" %r - %r %%" %(GC_SMALL, GC_LARGE))
+        series3 = plt.scatter(xlist3, ylist3, color = 'r', 
+                              marker = 'o', label="> %r %%" %(GC_LARGE))
+        leg = plt.legend(title = '% GC', scatterpoints = 1)
+        leg.get_frame().set_alpha(0.5)
+    showplot(fig, outfile)
+    return xlist.tolist(), xlist1.tolist(), xlist2.tolist(), \
+    xlist3.tolist(), ylist.tolist(), ylist1.tolist(), ylist2.tolist(), \
+    ylist3.tolist(), namelist.tolist()
+
+
+
+
+
+def covhistogram(dictionary, outfile = None, sample = None):
+    """Create a histogram over coverage. The argument needed is a ContigTable
+    or a dictionary where the item is an object of the class Fasta and the 
+    key is the name of the contig. If outfile is given, the plot is 
+    saved to it instead of shown. sample is shown in the title when the 
+    coverage is that of one sample of a CoverageMatrix.
+    """
+    table = as_table(dictionary)
+    histlist = table.coverage[table.covered()]
+    histplot(LogHistogram().add(histlist), 'Coverage histogram' + 
+             (' - %s' % sample if sample else ''), 'Coverage', outfile)
+    return histlist.tolist()
 
 
 
 
 
-def covlenplot(dictionary):
-    """Plot coverage against length. The argument needed is a dictionary 
-    where the item is an object of the class Fasta and the key is the 
-    name of the contig.
+def lenhistogram(dictionary, outfile = None):
+    """Create a histogram over length. The argument needed is a ContigTable 
+    or a dictionary where the item is an object of the class Fasta and the 
+    key is the name of the contig. If outfile is given, the plot is 
+    saved to it instead of shown.
     """
-    contig = conname(None)
-    namelist = []
-    xlist, xlist1, xlist2, xlist3 = [], [], [], []
-    ylist, ylist1, ylist2, ylist3 = [], [], [], []
-    for key in dictionary:
-        if isNaN(dictionary[key].getcoverage()) == False:
-            xlist.append(dictionary[key].getcoverage())
-            ylist.append(dictionary[key].length())
-            namelist.append(dictionary[key].header())
-            if dictionary[key].gccount() > GC_LARGE:
-                xlist3.append(dictionary[key].getcoverage())
-                ylist3.append(dictionary[key].length())
-            elif GC_SMALL <= dictionary[key].gccount() <= GC_LARGE:
-                xlist2.append(dictionary[key].getcoverage())
-                ylist2.append(dictionary[key].length())
-            elif dictionary[key].gccount() < GC_SMALL:
-                xlist1.append(dictionary[key].getcoverage())
-                ylist1.append(dictionary[key].length())
-            else:
-                pass
+    table = as_table(dictionary)
+    histlist = table.length
+    histplot(LogHistogram().add(histlist), 'Length histogram', 'Length', 
+             outfile)
+    return histlist.tolist()
+
 
-    def onpick(event):
-        global annotation
-        global mark
-        if mark != None: 
-            try:
-                ax.lines.remove(mark)
-                annotation.remove()
-            except:
-                pass
-        ind = event.ind
-        contigname = namelist[int(ind[0])]
-        contig.name = contigname
-        contig_info = "%s \n Length: %r \n GC: %r \n Coverage: %r \n N: %r" \
-                      %(contig.name, dictionary[contig.name].length(), 
-                      dictionary[contig.name].gccount(), 
-                      dictionary[contig.name].getcoverage(), 
-                      dictionary[contig.name].ncontent())
-        mark, = ax.plot(xlist[ind[0]], ylist[ind[0]], 
-                            color = 'c', marker = 'o')
-        annotation = ax.text(0.8, 0.15, contig_info, 
-                             horizontalalignment='center', 
-                             verticalalignment='center', 
-                             transform = ax.transAxes)
-        def on_key(event):
-            global annotation
-            global mark
-            if event.key == 'control':
-                try:
-                    annotation.remove()
-                    ax.lines.remove(mark)
-                    fig.canvas.draw()
-                except: 
-                    pass
-            else:
-                pass
 
-        cid = fig.canvas.mpl_connect('key_press_event', on_key)
-        fig.canvas.draw()
 
-    def format_coord(x, y):
-        if contig.name:
-            return 'x=%.4f, y=%.4f, name: %s'%(x, y, contig.name)
-        else:
-            return 'x=%.4f, y=%.4f'%(x, y)
 
+def histplot(histogram, title, xlabel, outfile = None):
+    """Draw a LogHistogram with a log x axis. Only the counts are drawn, so 
+    a histogram merged from many files or read with read_histograms can be 
+    plotted without the values. If outfile is given, the plot is saved to 
+    it instead of shown.
+    """
     fig = plt.figure()
     ax = fig.add_subplot(111)
-    fig.canvas.mpl_connect('pick_event', onpick)
-    ax.format_coord = format_coord
-    series = plt.scatter(xlist, ylist, marker = 'o', facecolors = 'none', 
-                         edgecolors = 'none', picker = 0.5)
-    series1 = plt.scatter(xlist1, ylist1, color = 'k', 
-                          marker = 'o', label="< %r %%" %(GC_SMALL))
-    series2 = plt.scatter(xlist2, ylist2, color = 'b', 
-                          marker = 'o', label=" %r - %r %%" %(GC_SMALL, GC_LARGE))
-    series3 = plt.scatter(xlist3, ylist3, color = 'r', 
-                          marker = 'o', label="> %r %%" %(GC_LARGE))
-    plt.suptitle('Length - Coverage', fontsize = 20)
-    plt.ylabel('Contig length')
-    plt.xlabel('Coverage')
-    leg = plt.legend(title = '% GC', scatterpoints = 1)
-    leg.get_frame().set_alpha(0.5)
-    plt.show()
-    return xlist, xlist1, xlist2, xlist3, ylist, ylist1, ylist2, ylist3,\
-    namelist
+    plt.hist(histogram.bins[:-1], bins = histogram.bins, 
+             weights = histogram.counts)
+    ax.set_xscale('log')
+    plt.suptitle(title, fontsize = 20)
+    plt.xlabel(xlabel)
+    plt.ylabel('Frequency')
+    showplot(fig, outfile)
 
 
 
 
 
-def covhistogram(dictionary):
-    """Create a histogram over coverage. The argument needed is a dictionary 
-    where the item is an object of the class Fasta and the key is the name 
-    of the contig.
+def densityplot(ax, xlist, ylist, xlog = False, ylog = False, 
+                bins = DENSITY_BINS):
+    """Draw how many points fall in each cell of a bins x bins grid as an 
+    image, instead of drawing one marker per point, so the time it takes 
+    depends on the grid and not on the number of points. The arguments 
+    needed are the axes and NumPy arrays with the x and y values. Axes with 
+    xlog or ylog get logarithmic cells and scale, and points that are not 
+    positive are left out on them. Returns the counts in the grid.
     """
-    histlist = []
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    for key in dictionary:
-        if isNaN(dictionary[key].getcoverage()) == False:
-            histlist.append(dictionary[key].getcoverage())
-    plt.hist(histlist, bins=np.logspace(0.1, 7, 200)) # These values can be
-                                                      # changed to get another
-                                                      # range or bin size.
-    ax.set_xscale('log')
-    plt.suptitle('Coverage histogram', fontsize = 20)
-    plt.xlabel('Coverage')
-    plt.ylabel('Frequency')
-    plt.show()
-    return histlist
+    from matplotlib.colors import LogNorm
+    keep = np.isfinite(xlist) & np.isfinite(ylist)
+    if xlog:
+        keep &= xlist > 0
+    if ylog:
+        keep &= ylist > 0
+    xlist, ylist = xlist[keep], ylist[keep]
+    if not len(xlist):
+        return np.zeros((bins, bins))
+    counts, xedges, yedges = np.histogram2d(xlist, ylist, 
+                                            bins = (gridedges(xlist, bins, xlog),
+                                                    gridedges(ylist, bins, ylog)))
+    image = ax.pcolormesh(xedges, yedges, np.ma.masked_equal(counts.T, 0), 
+                          norm = LogNorm(), rasterized = True)
+    if xlog:
+        ax.set_xscale('log')
+    if ylog:
+        ax.set_yscale('log')
+    ax.set_xlim(xedges[0], xedges[-1])
+    ax.set_ylim(yedges[0], yedges[-1])
+    ax.figure.colorbar(image, ax = ax, label = 'Contigs')
+    return counts
+
+
+
+
+
+def gridedges(values, bins, log = False):
+    """Return bins + 1 cell edges from the lowest to the highest value, 
+    evenly spaced on a linear or logarithmic scale.
+    """
+    low, high = values.min(), values.max()
+    if log:
+        low, high = np.log10(low), np.log10(high)
+    if high == low:
+        high = low + 1
+    if log:
+        return np.logspace(low, high, bins + 1)
+    return np.linspace(low, high, bins + 1)
 
 
 
 
 
-def lenhistogram(dictionary):
-    """Create a histogram over length. The argument needed is a dictionary 
-    where the item is an object of the class Fasta and the key is the name 
-    of the contig.
+def showplot(fig, outfile = None):
+    """Show the figure, or save it to outfile (the format is given by the 
+    extension, such as .png, .svg or .pdf) and close it.
     """
-    histlist = []
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    for key in dictionary:
-        histlist.append(dictionary[key].length())
-    plt.hist(histlist, bins=np.logspace(0.1, 7, 200))
-    ax.set_xscale('log')
-    plt.suptitle('Length histogram', fontsize = 20)
-    plt.xlabel('Length')
-    plt.ylabel('Frequency')
-    plt.show()
-    return histlist
+    if outfile:
+        fig.savefig(outfile)
+        plt.close(fig)
+    else:
+        plt.show()
+
+
+
+
+
+def render_plot(job):
+    """Draw one plot of plot_table to a file with a non-interactive backend.
+    Run in a worker process by render_plots. The argument needed is a tuple
+    (plot function, outfile) or (plot function, outfile, sample), where the
+    plot is drawn with the coverage of that sample of plot_matrix. Returns 
+    an error message, or None.
+    """
+    plot, outfile = job[:2]
+    try:
+        plt.switch_backend('Agg')
+        if len(job) > 2:
+            plot(plot_table.with_coverage(plot_matrix.sample(job[2])), 
+                 outfile = outfile, sample = job[2])
+        else:
+            plot(plot_table, outfile = outfile)
+    except Exception as error:
+        return "ERROR: Could not draw %s: %s\n" %(plot.__name__, error)
+
+
+
+
+
+def render_plots(table, plots, plotdir, prefix, fmt = 'png', matrix = None, 
+                 sampleplots = (), samples = ()):
+    """Save plots of a ContigTable to files in plotdir, named 
+    prefix.plotname.fmt, without showing them. sampleplots are also drawn 
+    once for each of samples with the coverage of that sample in the 
+    CoverageMatrix matrix, named prefix.sample.plotname.fmt. The plots are
+    drawn in parallel, one per process and at most one process per CPU. The
+    table and matrix are made globals before the processes are started, so 
+    they share them instead of each getting a copy sent to it. Returns the 
+    list of files.
+    """
+    global plot_table, plot_matrix
+    jobs = [(plot, os.path.join(plotdir, '%s.%s.%s' 
+                                %(prefix, plot.__name__, fmt))) 
+            for plot in plots]
+    jobs += [(plot, os.path.join(plotdir, '%s.%s.%s.%s' 
+                                 %(prefix, sample, plot.__name__, fmt)), sample)
+             for sample in samples for plot in sampleplots]
+    if not jobs:
+        return []
+    if not os.path.isdir(plotdir):
+        os.makedirs(plotdir)
+    outfiles = [job[1] for job in jobs]
+    plot_table, plot_matrix = table, matrix
+    plt.switch_backend('Agg') # Imports pyplot once, before the processes 
+                              # are forked, instead of once in each of them.
+    pool = multiprocessing.Pool(min(len(jobs), multiprocessing.cpu_count()))
+    try:
+        errors = pool.map(render_plot, jobs, chunksize = 1)
+    finally:
+        pool.close()
+        pool.join()
+        plot_table, plot_matrix = None, None
+    for error in errors:
+        if error:
+            sys.stderr.write(error)
+    return [outfile for outfile, error in zip(outfiles, errors) if not error]
+
+
+
+
+
+def nx(cumulative, total, fraction):
+    """Return Nx and Lx for one fraction (0.5 for N50 and L50) of total: the
+    length of the contig that brings the sum of the longest contigs to the 
+    fraction of total, and how many contigs that takes. cumulative is the 
+    cumulative sum of the contig lengths sorted from longest to shortest 
+    (see assembly_summary). Returns (None, None) if the contigs never reach
+    the fraction of total.
+    """
+    count = np.searchsorted(cumulative, fraction * total) + 1
+    if total <= 0 or count > len(cumulative):
+        return None, None
+    if count > 1:
+        return int(cumulative[count - 1] - cumulative[count - 2]), int(count)
+    return int(cumulative[0]), 1
+
+
+
+
+
+def assembly_summary(table, genome_size = None, lengths = None):
+    """Summarize the contigs of a ContigTable: count, total length, N50/L50
+    and N90/L90, NG50/LG50 if genome_size is given, the length weighted mean
+    GC content and percentiles of the GC content of the contigs, and the 
+    number of contigs in each length and GC class. The lengths are sorted 
+    once, or given already sorted in increasing order as lengths, and every 
+    Nx is read from their cumulative sum. Returns an ordered dictionary, 
+    values that can't be calculated are None.
+    """
+    if lengths is None:
+        lengths = np.sort(table.length)
+    lengths = lengths[::-1]
+    cumulative = np.cumsum(lengths)
+    total = int(cumulative[-1]) if len(cumulative) else 0
+    summary = collections.OrderedDict()
+    summary['contigs'] = len(table)
+    summary['total_length'] = total
+    summary['n_count'] = int(table.n_count.sum())
+    summary['largest'] = int(lengths[0]) if len(lengths) else None
+    summary['N50'], summary['L50'] = nx(cumulative, total, 0.5)
+    summary['N90'], summary['L90'] = nx(cumulative, total, 0.9)
+    if genome_size:
+        summary['NG50'], summary['LG50'] = nx(cumulative, genome_size, 0.5)
+    gc = table.gc[~np.isnan(table.gc)]
+    weights = (table.length - table.n_count)[~np.isnan(table.gc)]
+    summary['gc_mean'] = None
+    if weights.sum() > 0:
+        summary['gc_mean'] = round(float(np.dot(gc, weights) / 
+                                         weights.sum()), 1)
+    for percentile in (5, 25, 50, 75, 95):
+        summary['gc_p%d' % percentile] = None
+        if len(gc):
+            summary['gc_p%d' % percentile] = round(float(
+                np.percentile(gc, percentile)), 1)
+    for label, mask in zip(('length_small', 'length_medium', 'length_large'),
+                           table.length_classes()):
+        summary[label] = int(mask.sum())
+    for label, mask in zip(('gc_low', 'gc_medium', 'gc_high'), 
+                           table.gc_classes()):
+        summary[label] = int(mask.sum())
+    return summary
+
+
+
+
+
+def write_summary(outfile, summary):
+    """Write a summary from assembly_summary, one name and value separated 
+    by tab per line. Missing values are written as 'nan'.
+    """
+    outfile.write(''.join(['%s\t%s\n' %(name, 'nan' if value is None 
+                                               else value) 
+                           for name, value in summary.iteritems()]))
+
+
+
+
+
+class Profiler(object):
+    """Wall time, CPU time (including child processes), bytes read and 
+    memory of the named stages of a run. Use as
+        profiler = Profiler()
+        with profiler.stage('read_table'):
+            table = read_table(infile)
+        profiler.write(outfile)
+    Bytes read come from /proc/self/io and are None where that is missing. 
+    They count reads from files and pipes, not pages of memory mapped files.
+    Memory is read without changing anything the kernel reports to other 
+    tools (such as the peak RSS seen by /usr/bin/time): peak_rss is the 
+    high-water mark of the RSS of the process so far (ru_maxrss, VmHWM on 
+    Linux) at the end of the stage, and peak_growth is how much the stage 
+    raised it, so the stages that set the peak of a run are those with 
+    peak_growth above 0. rss is the RSS at the end of the stage (None 
+    without /proc/self/status). children_max_rss is the largest RSS of any
+    finished child process so far, such as the workers of the plot and read
+    pools.
+    With pstats = True, every stage also runs under cProfile, which makes it
+    slower, and dump_stats writes the statistics of the slowest stage.
+    """
+    def __init__(self, pstats = False):
+        self.stages = []
+        self.pstats = pstats
+        self.profiles = {}
+
+    @staticmethod
+    def rss():
+        """Return the current RSS in bytes, or None if it can't be read."""
+        try:
+            with open('/proc/self/status') as infile:
+                for line in infile:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except (IOError, OSError):
+            pass
+        return None
+
+    @staticmethod
+    def sample():
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        scale = 1 if sys.platform == 'darwin' else 1024 # Kilobytes everywhere
+        read = None                                     # but on Mac OS.
+        if os.path.exists('/proc/self/io'):
+            with open('/proc/self/io') as infile:
+                for line in infile:
+                    if line.startswith('rchar:'):
+                        read = int(line.split()[1])
+        return (time.time(), own.ru_utime + own.ru_stime + 
+                children.ru_utime + children.ru_stime, read, 
+                own.ru_maxrss * scale, children.ru_maxrss * scale)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measure the code in the with block as the stage name."""
+        profile = cProfile.Profile() if self.pstats else None
+        wall, cpu, read, peak = self.sample()[:4]
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+                self.profiles[name] = profile
+            after = self.sample()
+            self.stages.append({'name': name, 
+                                'wall': after[0] - wall,
+                                'cpu': after[1] - cpu,
+                                'bytes_read': None if read is None 
+                                              else after[2] - read,
+                                'peak_rss': after[3],
+                                'peak_growth': after[3] - peak,
+                                'rss': self.rss(),
+                                'children_max_rss': after[4]})
+
+    def report(self):
+        """Return the stages and their totals as a dictionary."""
+        last = self.sample()
+        total = {'wall': sum(stage['wall'] for stage in self.stages),
+                 'cpu': sum(stage['cpu'] for stage in self.stages),
+                 'peak_rss': last[3], 
+                 'children_max_rss': last[4]}
+        return {'stages': self.stages, 'total': total}
+
+    def write(self, outfile):
+        """Write the report as JSON to outfile."""
+        json.dump(self.report(), outfile, indent = 2, sort_keys = True)
+        outfile.write('\n')
+
+    def dump_stats(self, path):
+        """Write the cProfile statistics of the slowest stage to path (read 
+        them with the pstats module) and return the name of that stage.
+        """
+        slowest = max((stage for stage in self.stages 
+                       if stage['name'] in self.profiles), 
+                      key = lambda stage: stage['wall'])['name']
+        self.profiles[slowest].dump_stats(path)
+        return slowest
+
+
+
+
+
+def write_table(outfile, table, columns = TABLE_COLUMNS, fmt = 'tsv'):
+    """Write the columns of a ContigTable to outfile, which must be opened 
+    in binary mode for fmt = 'npz'. The formats are:
+    tsv - the report printed by this script, one field per column followed 
+          by ' \t' and the coverage last, left empty where it is missing.
+    csv - comma separated with a header line and empty missing values.
+    npz - a NumPy .npz file with one array per column.
+    Text is formatted TABLE_BLOCK rows at a time and written as one string 
+    per block.
+    """
+    if fmt == 'npz':
+        arrays = dict((column, getattr(table, column)) for column in columns)
+        if 'name' in arrays:
+            arrays['name'] = np.array(table.name.tolist(), dtype = str)
+        np.savez(outfile, **arrays)
+        return
+    if fmt == 'tsv':
+        row = ''.join('%s' if column == 'coverage' else '%s \t' 
+                      for column in columns) + '\n'
+    else:
+        writer = csv.writer(outfile, lineterminator = '\n')
+        writer.writerow(columns)
+    for start in xrange(0, len(table), TABLE_BLOCK):
+        rows = table.take(np.arange(start, min(start + TABLE_BLOCK, 
+                                               len(table))))
+        values = [getattr(rows, column).tolist() for column in columns]
+        if 'coverage' in columns:
+            cov = columns.index('coverage')
+            values[cov] = ['' if isNaN(value) else value 
+                           for value in values[cov]]
+        if fmt == 'tsv':
+            outfile.write(''.join([row % fields for fields in zip(*values)]))
+        else:
+            writer.writerows(zip(*values))
 
 
 
@@ -518,14 +2968,279 @@ def isNaN(num):
 
 
 
+def batch_jobs(source):
+    """Return the list of (fasta file, coverage file or None) to analyze in 
+    batch mode. source is either a directory, where every file ending with 
+    one of FASTA_EXTENSIONS is used together with the file with the same 
+    name and one of COVERAGE_EXTENSIONS if there is one, or a manifest file
+    with one fasta file and optionally its coverage file, separated by tab,
+    per line. Relative paths in a manifest are relative to the manifest.
+    """
+    jobs = []
+    if os.path.isdir(source):
+        for filename in sorted(os.listdir(source)):
+            for extension in FASTA_EXTENSIONS:
+                if filename.endswith(extension):
+                    stem = os.path.join(source, filename[:-len(extension)])
+                    covs = [stem + ext for ext in COVERAGE_EXTENSIONS 
+                            if os.path.isfile(stem + ext)]
+                    jobs.append((os.path.join(source, filename), 
+                                 covs[0] if covs else None))
+                    break
+        return jobs
+    folder = os.path.dirname(source)
+    with open(source) as manifest:
+        for line in manifest:
+            fields = line.rstrip('\r\n').split('\t')
+            if not fields[0] or fields[0].startswith('#'):
+                continue
+            paths = [os.path.join(folder, field) for field in fields[:2] 
+                     if field]
+            jobs.append((paths[0], paths[1] if len(paths) > 1 else None))
+    return jobs
+
+
+
+
+
+def analyze_assembly(job):
+    """Read one fasta file and its coverage file in a worker process of 
+    run_batch. The argument needed is a tuple (fasta file, coverage file or 
+    None, genome size or None). Returns (ContigTable, summary, messages), 
+    where messages holds what was written to stderr, or (None, None, error 
+    message) if the files could not be read.
+    """
+    fasta, covfile, genome_size = job
+    stderr = sys.stderr
+    sys.stderr = cStringIO.StringIO()
+    try:
+        infiles = [open_input(path) for path in (fasta, covfile) if path]
+        try:
+            for infile in infiles:
+                if isinstance(infile, BgzfReader):
+                    infile.processes = 1 # Workers can't start processes.
+            table = read_table(infiles[0])
+            if covfile:
+                read_covfile(infiles[1], table)
+        finally:
+            for infile in infiles:
+                infile.close()
+        return table, assembly_summary(table, genome_size), \
+               sys.stderr.getvalue()
+    except Exception as error:
+        return None, None, "ERROR: %s\n" % error
+    finally:
+        sys.stderr = stderr
+
+
+
+
+
+def run_batch(jobs, table, summary, processes = None, genome_size = None, 
+              histograms = None):
+    """Analyze many fasta files (the list from batch_jobs) with a pool of 
+    processes, largest file first so that no process is left with a large 
+    file at the end. The statistics of all contigs are written to the file
+    table, with the assembly (the fasta file) in the first column, and the 
+    summary of each assembly (see assembly_summary) to the file summary, 
+    both with a header line and separated by tab. A file that can't be read 
+    is reported and listed with its error in summary, and the others are 
+    still analyzed. The histograms of all assemblies are merged into 
+    histograms (see table_histograms) if it is a dictionary. Returns the 
+    number of files that failed.
+    """
+    def size(job):
+        try:
+            return os.path.getsize(job[0])
+        except OSError:
+            return 0
+    jobs = sorted(jobs, key = size, reverse = True)
+    table.write('assembly\t' + '\t'.join(TABLE_COLUMNS) + '\n')
+    header = list(assembly_summary(ContigTable([], [], [], []), genome_size))
+    summary.write('assembly\terror\t' + '\t'.join(header) + '\n')
+    failed = 0
+    pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+    try:
+        for (fasta, covfile), (contigs, stats, messages) in zip(jobs, 
+            pool.imap(analyze_assembly, [(fasta, covfile, genome_size) 
+                                         for fasta, covfile in jobs], 
+                      chunksize = 1)):
+            for message in messages.splitlines():
+                sys.stderr.write('%s: %s\n' %(fasta, message))
+            if contigs is None:
+                failed += 1
+                error = '; '.join([' '.join(line.split()) for line 
+                                   in messages.splitlines() if line.strip()])
+                summary.write('%s\t%s%s\n' %(fasta, error, 
+                                              '\t' * len(header)))
+                continue
+            summary.write('%s\t\t%s\n' %(fasta, '\t'.join(
+                ['nan' if stats[key] is None else str(stats[key]) 
+                 for key in header])))
+            if histograms is not None:
+                for name, histogram in table_histograms(contigs).iteritems():
+                    if name in histograms:
+                        histograms[name].merge(histogram)
+                    else:
+                        histograms[name] = histogram
+            row = fasta.replace('%', '%%') + '\t%s' * len(TABLE_COLUMNS) + '\n'
+            table.write(''.join([row % fields for fields in 
+                                 zip(*[getattr(contigs, column).tolist() 
+                                       for column in TABLE_COLUMNS])]))
+    finally:
+        pool.close()
+        pool.join()
+    return failed
+
+
+
+
+
 def run(args):
     """ Print the outputs that were chosen. The argument needed is the 
     parser.parse_args() that determines which flags and infiles the 
     script can use.
     """
-    dictionary = read_file(args.infile)
+    profiler = Profiler(pstats = bool(args.pstats))
+    try:
+        if args.batch:
+            with profiler.stage('batch'):
+                batch(args)
+        else:
+            stages(args, profiler)
+    finally:
+        if args.pstats and profiler.profiles:
+            profiler.dump_stats(args.pstats)
+        if args.profile:
+            with open(args.profile, 'w') as outfile:
+                profiler.write(outfile)
+
+
+
+
+
+def batch(args):
+    """Run batch mode (see run_batch) for args.batch, writing the table to 
+    args.output or stdout and the summaries to args.batchsummary.
+    """
+    jobs = batch_jobs(args.batch)
+    table = open(args.output, 'w') if args.output else sys.stdout
+    summaryfile = args.batchsummary
+    if not summaryfile:
+        summaryfile = os.path.splitext(args.output)[0] + '.summary.tsv' \
+                      if args.output else 'batch.summary.tsv'
+    histograms = collections.OrderedDict() if args.histograms else None
+    try:
+        with open(summaryfile, 'w') as summary:
+            failed = run_batch(jobs, table, summary, 
+                               args.threads, args.genomesize, histograms)
+    finally:
+        if args.output:
+            table.close()
+    if args.histograms:
+        with open(args.histograms, 'w') as outfile:
+            write_histograms(outfile, histograms)
+    if failed:
+        sys.stderr.write("ERROR: %d of %d assemblies could not be read, see "
+                         "%s.\n" %(failed, len(jobs), summaryfile))
+
+
+
+
+
+def filter_contigs(args):
+    """Write the contigs that pass --minlen, --gcrange, --mincov, --names and
+    --exclude to args.filter (see filter_fasta).
+    """
+    try:
+        gc_range = args.gcrange and tuple(float(value) for value 
+                                          in args.gcrange.split(','))
+        if gc_range and len(gc_range) != 2:
+            raise ValueError
+    except ValueError:
+        sys.stderr.write("ERROR: --gcrange must be two numbers, as 30,60.\n")
+        return
+    if args.mincov is not None and not args.coverage:
+        sys.stderr.write("ERROR: --mincov needs a coverage file.\n")
+        return
+    keep = RecordFilter(args.minlen, gc_range, args.mincov)
+    if args.mincov is not None:
+        keep.coverage = read_coverage(args.coverage)
+    for attribute, path in (('names', args.names), 
+                            ('exclude', args.exclude)):
+        if path:
+            with open(path) as infile:
+                setattr(keep, attribute, read_names(infile))
+    outfile = sys.stdout if args.filter == '-' else open(args.filter, 'wb')
+    try:
+        filter_fasta(args.infile, outfile, keep)
+    finally:
+        if outfile is not sys.stdout:
+            outfile.close()
+        args.infile.close()
+        if args.coverage:
+            args.coverage.close()
+
+
+
+
+
+def stages(args, profiler):
+    """Run the outputs that were chosen, each as a stage of profiler. Called
+    by run.
+    """
+    global DENSITY_POINTS
+    if args.fetch:
+        if not isplainfile(args.infile):
+            sys.stderr.write("ERROR: Can't fetch contigs from stdin or a "
+                             "compressed file.\n")
+        else:
+            with profiler.stage('fetch'):
+                print_regions(args.infile.name, args.fetch)
+        args.infile.close()
+        return
+    if args.filter:
+        with profiler.stage('filter'):
+            filter_contigs(args)
+        return
+    if args.follow is not None or args.checkpoint:
+        if not isplainfile(args.infile):
+            sys.stderr.write("ERROR: Can't follow stdin or a compressed "
+                             "file.\n")
+            args.infile.close()
+            return
+        table = follow(args, profiler)
+    else:
+        with profiler.stage('read_table'):
+            table = read_table(args.infile, args.threads or 1, args.cache)
     if args.coverage:
-        read_covfile(args.coverage, dictionary)
+        with profiler.stage('read_covfile'):
+            read_covfile(args.coverage, table)
+    if args.depth:
+        with profiler.stage('read_depthfile'):
+            read_depthfile(args.depth, table, args.depthstat)
+    matrix, samples = None, []
+    if args.covmatrix:
+        with profiler.stage('read_covmatrix'):
+            matrix = read_covmatrix(args.covmatrix, table)
+        if not (args.coverage or args.depth): # The mean over the samples is
+            table.coverage = matrix.mean()    # the coverage.
+        if args.samples == 'all':
+            samples = matrix.samples
+        elif args.samples:
+            samples = args.samples.split(',')
+        ratios = [tuple(pair.split(',')) for pair in args.logratio or []]
+        unknown = [sample for sample in list(samples) + list(sum(ratios, ()))
+                   if sample not in matrix.samples]
+        if unknown or any(len(pair) != 2 for pair in ratios):
+            sys.stderr.write("ERROR: Unknown samples or bad --logratio: %s."
+                             "\n" % ', '.join(unknown or args.logratio))
+            samples, ratios = [], []
+        if args.matrixstats:
+            with open(args.matrixstats, 'w') as outfile, \
+                 profiler.stage('matrixstats'):
+                write_matrixstats(outfile, table, matrix, ratios)
+    coverage = args.coverage or args.depth or args.covmatrix
     if args.allflags: # If "-all"-flag is given, set flags to True.
         args.header = True
         args.length = True
@@ -533,61 +3248,130 @@ def run(args):
         args.ncontent = True
         args.lengcplot = True
         args.lenhistogram = True
-        if args.coverage:
+        if coverage:
             args.covgcplot = True
             args.covlenplot = True
             args.covhistogram = True
-    for key in sorted(dictionary):
-        if args.header == True:
-            print dictionary[key].header(), '\t',
-        if args.length == True:
-            print dictionary[key].length(), '\t',
-        if args.gccontent == True:
-            print dictionary[key].gccount(), '\t',
-        if args.ncontent == True:
-            print dictionary[key].ncontent(), '\t',
-        if args.coverage:
-            if isNaN(dictionary[key].getcoverage()):
-                print >> sys.stderr, dictionary[key].getcoverage(),
-            else:
-                print dictionary[key].getcoverage(),
-        if len(sys.argv) > 2:    # If no flags are given, 
-                                 # no line breaks are printed.
-            print	# Just there to introduce a line break.
+    columns = [column for column, flag in (('name', args.header), 
+                                           ('length', args.length),
+                                           ('gc', args.gccontent),
+                                           ('n_count', args.ncontent),
+                                           ('coverage', coverage)) if flag]
+    if coverage:
+        missing = np.isnan(table.coverage).sum()
+        if missing:
+            sys.stderr.write("ERROR: No coverage for %d of %d contigs.\n" 
+                             %(missing, len(table)))
+    if not columns and (args.output or args.format != 'tsv'):
+        columns = list(TABLE_COLUMNS) # A table file gets all the columns.
+    if columns and args.format == 'npz' and not args.output:
+        sys.stderr.write("ERROR: --format npz needs an output file (-o).\n")
+        columns = []
+    if columns:
+        if args.output:
+            outfile = open(args.output, 'wb' if args.format == 'npz' else 'w')
+        else:
+            outfile = sys.stdout
+        try:
+            with profiler.stage('write_table'):
+                write_table(outfile, table.sorted(), columns, args.format)
+        finally:
+            if args.output:
+                outfile.close()
+    if args.summary:
+        with profiler.stage('summary'):
+            write_summary(sys.stdout, assembly_summary(table, 
+                                                       args.genomesize))
+    if args.histograms:
+        with open(args.histograms, 'w') as outfile, \
+             profiler.stage('histograms'):
+            write_histograms(outfile, table_histograms(table))
+    if (args.gcwindows or args.skewplot) and \
+       not (args.window > 0 and args.step > 0):
+        sys.stderr.write("ERROR: The window size and step must be at least 1."
+                         "\n")
+        args.gcwindows = args.skewplot = None
+    if args.gcwindows:
+        with open(args.gcwindows, 'w') as outfile, \
+             profiler.stage('gcwindows'):
+            write_gcwindows(args.infile, outfile, args.window, args.step)
+    if args.kmers:
+        if not 1 <= args.kmersize <= KMER_MAX:
+            sys.stderr.write("ERROR: The k-mer size must be between 1 and %d."
+                             "\n" % KMER_MAX)
+        else:
+            with profiler.stage('kmers'):
+                write_kmerprofiles(args.infile, args.kmers, args.kmersize)
+    if args.skewplot:
+        with profiler.stage('findrecord'):
+            fs = findrecord(args.infile, args.skewplot)
+        if fs is None:
+            sys.stderr.write("ERROR: Contig %r not found.\n" % args.skewplot)
+        else:
+            skewfile = None
+            if args.plotdir:
+                if not os.path.isdir(args.plotdir):
+                    os.makedirs(args.plotdir)
+                plt.switch_backend('Agg')
+                skewfile = os.path.join(args.plotdir, 'gcskew.%s.%s' 
+                                        %(indexname(fs.header()), 
+                                          args.plotformat))
+            with profiler.stage('gcskewplot'):
+                gcskewplot(fs.header(), *gcwindows(fs.seq, args.window, 
+                                                   args.step), 
+                           outfile = skewfile)
+    plots = []
     if args.lengcplot == True:
-        lengcplot(dictionary)
+        plots.append(lengcplot)
     if args.covgcplot == True:
-        if args.coverage:
-            try:
-                covgcplot(dictionary)
-            except:
-                sys.stderr.write("ERROR: Correct coverage file not supplied?")
+        if coverage:
+            plots.append(covgcplot)
         else:
             sys.stderr.write("ERROR: Can't run function 'covgcplot'. \
                               No coverage file supplied.\n")
     if args.covlenplot == True:
-        if args.coverage:
-            covlenplot(dictionary)
+        if coverage:
+            plots.append(covlenplot)
         else:
             sys.stderr.write("ERROR: Can't run function 'covlenplot'. \
                               No coverage file supplied.\n")
     if args.covhistogram == True:
-        if args.coverage:
-            covhistogram(dictionary)
+        if coverage:
+            plots.append(covhistogram)
         else:
             sys.stderr.write("ERROR: Can't run function 'covhistogram'. \
                               No coverage file supplied.\n")
     if args.lenhistogram == True:
-        lenhistogram(dictionary)
+        plots.append(lenhistogram)
+    sampleplots = [plot for plot in (covgcplot, covhistogram) 
+                   if plot in plots]
+    DENSITY_POINTS = args.density
+    if args.plotdir:
+        prefix = 'stdin' if args.infile is sys.stdin else \
+                 os.path.basename(args.infile.name)
+        with profiler.stage('render_plots'):
+            render_plots(table, plots, args.plotdir, prefix, 
+                         args.plotformat, matrix, sampleplots, samples)
+    else:
+        for plot in plots:
+            with profiler.stage(plot.__name__):
+                plot(table)
+        for sample in samples:
+            for plot in sampleplots:
+                with profiler.stage('%s.%s' %(sample, plot.__name__)):
+                    plot(table.with_coverage(matrix.sample(sample)), 
+                         sample = sample)
     args.infile.close()
-    if args.coverage:
-        args.coverage.close()
+    for infile in (args.coverage, args.depth, args.covmatrix):
+        if infile:
+            infile.close()
 
 
 
 
 
-if __name__ == "__main__":
+def make_parser():
+    """Return the parser for the flags and infiles of the script."""
     parser = argparse.ArgumentParser(description = 
                                  """Analyze data from a fasta file and the 
                                     corresponding coverage file by calculating
@@ -596,15 +3380,57 @@ if __name__ == "__main__":
                                     """)
 
     parser.add_argument("infile", 
-                    type = argparse.FileType('r'), 
-                    help = "Infile in fasta format.", 
-                    default = sys.stdin)
+                    type = open_input, 
+                    help = "Infile in fasta format (can be gzip or BGZF "
+                           "compressed). Not used with --batch.", 
+                    nargs = '?')
 
     parser.add_argument("coverage",
-                    type = argparse.FileType('r'),
-                    help = "Coverage file (name and coverage separated by tab)",
+                    type = open_input,
+                    help = "Coverage file (name and coverage separated by "
+                           "tab, can be gzip or BGZF compressed)",
                     nargs = '?')
 
+    parser.add_argument("-d", "--depth",
+                    type = open_input,
+                    help = "Per-base depth file (name, position and depth "
+                           "separated by tab, as from samtools depth) to "
+                           "calculate the coverage from, instead of a "
+                           "coverage file.")
+
+    parser.add_argument("-m", "--covmatrix",
+                    type = open_input,
+                    help = "Coverage matrix file with the coverage of each "
+                           "contig in many samples: a header line with the "
+                           "sample names after the first column, then the "
+                           "name and the coverage in each sample separated by"
+                           " tab. Without a coverage or depth file, the mean "
+                           "over the samples is used as the coverage.")
+
+    parser.add_argument("--samples",
+                    help = "Also draw -cg and -ch for each of these samples "
+                           "of the coverage matrix (comma separated, or "
+                           "'all').")
+
+    parser.add_argument("--matrixstats",
+                    help = "Write the mean and coefficient of variation of "
+                           "the coverage over the samples, and the log "
+                           "ratios from --logratio, to this file.",
+                    metavar = "OUTFILE")
+
+    parser.add_argument("--logratio",
+                    help = "Add log2 of the ratio of the coverage in sample A"
+                           " to that in sample B to --matrixstats. Can be "
+                           "given more than once.",
+                    action = "append",
+                    metavar = "A,B")
+
+    parser.add_argument("--depthstat",
+                    help = "Use the mean (default) or median depth as the "
+                           "coverage.",
+                    choices = ["mean", "median"],
+                    default = "mean")
+
     parser.add_argument("-hd", "--header", 
                     help = "Print sequence headers.", 
                     action = "store_true")
@@ -621,6 +3447,52 @@ if __name__ == "__main__":
                     help = "Calculate the number of N in each sequence.",
                     action = "store_true")
 
+    parser.add_argument("-o", "--output",
+                    help = "Write the table to this file instead of printing"
+                           " it. Without -hd, -l, -gc or -n, all columns are "
+                           "written.",
+                    metavar = "OUTFILE")
+
+    parser.add_argument("--format",
+                    help = "Format of the table: tsv (default, as printed), "
+                           "csv (with a header line) or npz (NumPy arrays, "
+                           "needs -o).",
+                    choices = ["tsv", "csv", "npz"],
+                    default = "tsv")
+
+    parser.add_argument("-s", "--summary",
+                    help = "Print a summary of the assembly: number of "
+                           "contigs, total length, N50, L50, N90, L90, GC "
+                           "content and the number of contigs in each "
+                           "length and GC class.",
+                    action = "store_true")
+
+    parser.add_argument("--histograms",
+                    help = "Write the histograms of length, GC content and "
+                           "coverage (counts in fixed bins, merged over all "
+                           "files with --batch) to this file as JSON.",
+                    metavar = "OUTFILE")
+
+    parser.add_argument("--genomesize",
+                    help = "Genome size for NG50 and LG50 in the summary.",
+                    type = int,
+                    metavar = "SIZE")
+
+    parser.add_argument("--follow",
+                    help = "Keep reading the fasta file as it is written, "
+                           "every SECONDS, and print the summary when "
+                           "contigs are added. Stop with Ctrl-C to get the "
+                           "other outputs.",
+                    type = float,
+                    metavar = "SECONDS")
+
+    parser.add_argument("--checkpoint",
+                    help = "Continue reading the fasta file from where the "
+                           "last run with this checkpoint file stopped, and "
+                           "save where this run stops to it. The statistics "
+                           "of the contigs are kept next to it in FILE.rows.",
+                    metavar = "FILE")
+
     parser.add_argument("-lg", "--lengcplot", 
                     help = "Plot GC content against length.", 
                     action = "store_true")
@@ -641,6 +3513,113 @@ if __name__ == "__main__":
                     help = "Histogram over length.",
                     action = "store_true")
 
+    parser.add_argument("-w", "--gcwindows",
+                    help = "Write GC content and GC skew in windows along "
+                           "each sequence to this file (name, start, end, "
+                           "GC and skew separated by tab).",
+                    metavar = "OUTFILE")
+
+    parser.add_argument("--skewplot",
+                    help = "Plot GC content and GC skew in windows along "
+                           "this contig.",
+                    metavar = "CONTIG")
+
+    parser.add_argument("--window",
+                    help = "Window size for --gcwindows and --skewplot "
+                           "(default: %d)." % WINDOW_SIZE,
+                    type = int,
+                    default = WINDOW_SIZE)
+
+    parser.add_argument("--step",
+                    help = "Distance between the windows (default: %d)." 
+                           % WINDOW_STEP,
+                    type = int,
+                    default = WINDOW_STEP)
+
+    parser.add_argument("-k", "--kmers",
+                    help = "Write canonical k-mer frequencies of each "
+                           "sequence to this NumPy .npz file (arrays names, "
+                           "kmers and profiles).",
+                    metavar = "OUTFILE")
+
+    parser.add_argument("--kmersize",
+                    help = "k for --kmers, 1 to %d (default: %d)." 
+                           %(KMER_MAX, KMER_SIZE),
+                    type = int,
+                    default = KMER_SIZE)
+
+    parser.add_argument("--density",
+                    help = "Draw scatter plots with more points than this as "
+                           "a density image (default: %d)." % DENSITY_POINTS,
+                    metavar = "POINTS",
+                    type = int,
+                    default = DENSITY_POINTS)
+
+    parser.add_argument("--plotdir",
+                    help = "Save the plots to files in this directory, "
+                           "drawn in parallel without a display, instead of "
+                           "showing them.")
+
+    parser.add_argument("--plotformat",
+                    help = "File format of the plots saved to --plotdir "
+                           "(default: png).",
+                    choices = ["png", "svg", "pdf"],
+                    default = "png")
+
+    parser.add_argument("-f", "--fetch",
+                    help = "Print a contig or a region of it ('name' or "
+                           "'name:start-end') using a .fai index, without "
+                           "reading the rest of the file. Can be repeated.",
+                    metavar = "REGION",
+                    action = "append")
+
+    parser.add_argument("--filter",
+                    help = "Write the contigs that pass --minlen, --gcrange, "
+                           "--mincov, --names and --exclude to this fasta "
+                           "file ('-' for stdout), copied unchanged from the "
+                           "infile. Contigs that fail on their name or "
+                           "coverage are skipped without reading their "
+                           "sequence.",
+                    metavar = "OUTFILE")
+
+    parser.add_argument("--minlen",
+                    help = "Shortest contig written by --filter.",
+                    type = int)
+
+    parser.add_argument("--gcrange",
+                    help = "Lowest and highest GC content (%%) of the contigs "
+                           "written by --filter.",
+                    metavar = "LOW,HIGH")
+
+    parser.add_argument("--mincov",
+                    help = "Lowest coverage (from the coverage file) of the "
+                           "contigs written by --filter. Contigs without "
+                           "coverage are left out.",
+                    type = float)
+
+    parser.add_argument("--names",
+                    help = "File with the names of the contigs written by "
+                           "--filter, one per line.",
+                    metavar = "FILE")
+
+    parser.add_argument("--exclude",
+                    help = "File with the names of contigs left out by "
+                           "--filter, one per line.",
+                    metavar = "FILE")
+
+    parser.add_argument("-t", "--threads",
+                    help = "Number of processes used to read the fasta file "
+                           "(default: 1), or to analyze the assemblies of "
+                           "--batch (default: all CPUs).",
+                    type = int)
+
+    parser.add_argument("-C", "--cache",
+                    help = "Save the statistics next to the fasta file "
+                           "(infile.stats.npz) and use them instead of "
+                           "reading the fasta file again, as long as it has "
+                           "not changed.",
+                    action = "store_true")
+
     parser.add_argument("-all", "--allflags",
                     help = "Shortcut for using all flags.", # Plot functions 
                     action = "store_true")                  # that plot 
@@ -649,5 +3628,44 @@ if __name__ == "__main__":
                                                             # no coverage file
                                                             # is provided.
 
+    parser.add_argument("--batch",
+                    help = "Analyze every fasta file in this directory (with"
+                           " the coverage file of the same name ending with "
+                           ".cov, if there is one), or listed in this "
+                           "manifest file (fasta file and optionally coverage"
+                           " file separated by tab per line), with -t "
+                           "processes (default: all CPUs). The contigs of "
+                           "all files are written to -o (or printed) and the "
+                           "summary of each file to --batchsummary.",
+                    metavar = "SOURCE")
+
+    parser.add_argument("--batchsummary",
+                    help = "File for the summaries of --batch (default: the "
+                           "-o file ending with .summary.tsv, or "
+                           "batch.summary.tsv).",
+                    metavar = "OUTFILE")
+
+    parser.add_argument("--profile",
+                    help = "Write the wall time, CPU time, bytes read and "
+                           "peak memory of each stage of the run to this "
+                           "JSON file. Shown plots are timed until their "
+                           "window is closed.",
+                    metavar = "OUTFILE")
+
+    parser.add_argument("--pstats",
+                    help = "Run each stage under cProfile and write the "
+                           "statistics of the slowest stage to this file.",
+                    metavar = "OUTFILE")
+
+    return parser
+
+
+
+
+
+if __name__ == "__main__":
+    parser = make_parser()
     args = parser.parse_args()
+    if not args.infile and not args.batch:
+        parser.error("an infile or --batch is required")
     run(args)
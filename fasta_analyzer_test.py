@@ -1,8 +1,20 @@
 from nose.tools import *
 import fasta_analyzer
+import gzip
+import json
 import os
+import StringIO
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
 from mock import patch
 
+STARTUP_MARGIN = 0.05 # Seconds a text-only run may take over importing numpy.
+
 
 
 
@@ -74,6 +86,26 @@ def test_class():
 
 
 
+# Test if all bases are counted in one pass and the counts are kept.
+def test_basecount():
+    assert_equal(fasta_analyzer.basecount('GATtaca\nNNry-\n'), (3, 1, 1, 2, 2, 3))
+    assert_equal(fasta_analyzer.basecount(''), (0, 0, 0, 0, 0, 0))
+    with patch('fasta_analyzer.COUNT_CHUNK', 4):
+        assert_equal(fasta_analyzer.basecount('GATtaca\nNNry-\n'), 
+                     (3, 1, 1, 2, 2, 3))
+    fasta = fasta_analyzer.Fasta('>contig1', 'GGCCatNN\n')
+    assert_equal(fasta.counts, None)
+    assert_equal(fasta.gccount(), 66.7)
+    assert_equal(fasta.counts, (1, 2, 2, 1, 2, 0))
+    assert_equal(fasta.length(), 8)
+    assert_equal(fasta.ncontent(), 2)
+    assert_equal(fasta.sequence(), 'ggccatnn\n')
+    assert_true(fasta_analyzer.isNaN(fasta_analyzer.gcpercent(0, 0)))
+
+
+
+
+
 # Test if the fasta infile is read and saved in dictionary as expected. 
 def test_read_file():
     fasta_file.seek(0)
@@ -104,6 +136,656 @@ def test_read_file():
 
 
 
+# Test if packed sequences give the same sequence and counts as strings.
+def test_packedsequence():
+    packed = fasta_analyzer.PackedSequence('GATtaca\nNNry-\nNc\n')
+    assert_equal(len(packed), 14)
+    assert_equal(len(packed.bases), 4)
+    assert_equal(packed.runs, ((7, 2, 'n'), (9, 1, 'r'), (10, 1, 'y'), 
+                               (11, 1, '-'), (12, 1, 'n')))
+    assert_equal(packed.decode(), 'gattaca\nnnry-\nnc\n')
+    assert_equal(fasta_analyzer.PackedSequence('AC\r\nGT\r\nA').decode(), 
+                 'ac\r\ngt\r\na')
+    fasta = fasta_analyzer.Fasta('>contig1', 'GGCCatNN\n', packed = True)
+    assert_equal(fasta.counts, (1, 2, 2, 1, 2, 0))
+    assert_equal(fasta.gccount(), 66.7)
+    assert_equal(fasta.length(), 8)
+    assert_equal(fasta.ncontent(), 2)
+    assert_equal(fasta.sequence(), 'ggccatnn\n')
+    fasta_file.seek(0)
+    read_file = fasta_analyzer.read_file(fasta_file, packed = True)
+    fasta_file.seek(0)
+    unpacked = fasta_analyzer.read_file(fasta_file)
+    assert_equal(read_file['contig2'].sequence(), 
+                 unpacked['contig2'].sequence())
+    assert_equal(read_file['contig1'].length(), 85)
+    assert_equal(read_file['contig3'].sequence()[-6:], 'cannn\n')
+
+
+
+
+
+# Test if the fasta infile is read one sequence at a time.
+def test_iter_records():
+    records = fasta_analyzer.iter_records(fasta_file)
+    first = next(records)
+    assert_equal(first.header(), 'contig1')
+    assert_equal(first.length(), 85)
+    assert_equal([fs.header() for fs in records], ['contig2', 'contig3'])
+
+
+
+
+
+# Test if the statistics are calculated without keeping the sequences.
+def test_read_stats():
+    read_stats = fasta_analyzer.read_stats(fasta_file)
+    assert_equal(sorted(read_stats), ['contig1', 'contig2', 'contig3'])
+    assert_equal(read_stats['contig1'].length(), 85)
+    assert_equal(read_stats['contig1'].gccount(), 28.6)
+    assert_equal(read_stats['contig2'].ncontent(), 2)
+    assert_equal(read_stats['contig3'].length(), 111)
+    assert_false(hasattr(read_stats['contig3'], 'seq'))
+
+
+
+
+
+# Test if the columns and the length and GC classes of the table are correct.
+def test_contigtable():
+    table = fasta_analyzer.ContigTable.from_dict(dict_longcontigs)
+    assert_equal(len(table), 3)
+    sorted_table = table.sorted()
+    assert_equal(sorted_table.name.tolist(), ['contig1', 'contig2', 'contig3'])
+    assert_equal(sorted_table.length.tolist(), [7, 18000, 120000])
+    assert_equal(sorted_table.gc.tolist(), [28.6, 44.4, 58.3])
+    assert_equal(sorted_table.n_count.tolist(), [0, 0, 0])
+    small, medium, large = sorted_table.length_classes()
+    assert_equal(small.tolist(), [True, False, False])
+    assert_equal(medium.tolist(), [False, True, False])
+    assert_equal(large.tolist(), [False, False, True])
+    low, middle, high = sorted_table.gc_classes()
+    assert_equal(low.tolist(), [True, False, False])
+    assert_equal(high.tolist(), [False, False, True])
+    missing = fasta_analyzer.ContigTable(['a', 'b'], [1, 2], [50.0, 60.0],
+                                         [0, 0])
+    assert_equal(missing.covered().tolist(), [False, False])
+
+
+
+
+
+# Test if the .fai index is written and regions are fetched through it.
+def test_indexedfasta():
+    tempdir = tempfile.mkdtemp()
+    path = os.path.join(tempdir, 'indexed.fa')
+    with open(path, 'w') as outfile:
+        outfile.write('>contig1 description\nGATTA\nCAGAT\nTA\n'\
+                      '>contig2\nGGCC\nNN\n')
+    try:
+        index = fasta_analyzer.build_index(path)
+        assert_equal(open(path + '.fai').read(), 'contig1\t12\t21\t5\t6\n'\
+                                                 'contig2\t6\t45\t4\t5\n')
+        assert_equal(index.names, ['contig1', 'contig2'])
+        fasta = fasta_analyzer.IndexedFasta(path)
+        assert_true('contig1 description' in fasta)
+        assert_equal(fasta.fetch('contig1'), 'gattacagatta')
+        assert_equal(fasta.fetch('contig1', 3, 11), 'tacagatt')
+        assert_equal(fasta.fetch('contig2', 4), 'nn')
+        assert_equal(fasta.record('contig2').gccount(), 100.0)
+        fasta.close()
+        assert_equal(fasta_analyzer.parse_region('contig1:4-11'), 
+                     ('contig1', 3, 11))
+        assert_equal(fasta_analyzer.parse_region('contig1'), 
+                     ('contig1', 0, None))
+        os.remove(path + '.fai')
+        os.mkdir(path + '.fai') # The index can't be written.
+        with patch('sys.stderr', new_callable = StringIO.StringIO) as stderr:
+            index = fasta_analyzer.build_index(path)
+        assert_equal(index.names, ['contig1', 'contig2'])
+        assert_true(stderr.getvalue().startswith('WARNING: Could not save'))
+        irregular = os.path.join(tempdir, 'irregular.fa')
+        with open(irregular, 'w') as outfile:
+            outfile.write('>c1\nAC\nGTA\n')
+        with patch('sys.stderr', new_callable = StringIO.StringIO) as stderr:
+            fasta_analyzer.print_regions(irregular, ['c1'])
+        assert_equal(stderr.getvalue(), "ERROR: Different line length in "
+                     "sequence 'c1', can't index %s.\n" % irregular)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Test if the file is split at record boundaries and read in parallel.
+def test_parallel_stats():
+    tempdir = tempfile.mkdtemp()
+    path = os.path.join(tempdir, 'parallel.fa')
+    fasta_file.seek(0)
+    with open(path, 'w') as outfile:
+        outfile.write(fasta_file.read())
+    try:
+        ranges = fasta_analyzer.chunk_ranges(path, 8)
+        assert_equal(ranges, [(0, 97), (97, 207), (207, 330)])
+        table = fasta_analyzer.parallel_stats(path, 2)
+        assert_equal(table.name.tolist(), ['contig1', 'contig2', 'contig3'])
+        assert_equal(table.length.tolist(), [85, 98, 111])
+        assert_equal(table.n_count.tolist(), [1, 2, 3])
+        table['contig2'].setcoverage(5.0)
+        assert_equal(table.coverage.tolist()[1], 5.0)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Write text to a BGZF file, in blocks of blocksize bytes and with the empty
+# block that ends a BGZF file.
+def write_bgzf(path, text, blocksize):
+    with open(path, 'wb') as outfile:
+        for start in range(0, len(text), blocksize) + [len(text)]:
+            block = text[start:start + blocksize]
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            data = compressor.compress(block) + compressor.flush()
+            outfile.write('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff'\
+                          '\x06\x00BC\x02\x00' + 
+                          struct.pack('<H', len(data) + 25) + data +
+                          struct.pack('<II', zlib.crc32(block) & 0xffffffff, 
+                                      len(block)))
+
+
+
+
+
+# Test if gzip and BGZF compressed infiles are read like uncompressed ones.
+def test_open_input():
+    tempdir = tempfile.mkdtemp()
+    fasta_file.seek(0)
+    text = fasta_file.read()
+    try:
+        gzip_path = os.path.join(tempdir, 'compressed.fa.gz')
+        outfile = gzip.open(gzip_path, 'wb')
+        outfile.write(text)
+        outfile.close()
+        bgzf_path = os.path.join(tempdir, 'compressed.fa.bgz')
+        write_bgzf(bgzf_path, text, 50)
+        for path in (gzip_path, bgzf_path):
+            infile = fasta_analyzer.open_input(path)
+            assert_false(fasta_analyzer.isplainfile(infile))
+            assert_equal(''.join(infile), text)
+            stats = fasta_analyzer.read_stats(infile)
+            assert_equal(stats['contig3'].length(), 111)
+            infile.close()
+        assert_true(isinstance(fasta_analyzer.open_input(bgzf_path), 
+                               fasta_analyzer.BgzfReader))
+        plain = fasta_analyzer.open_input(os.path.abspath(__file__))
+        assert_true(fasta_analyzer.isplainfile(plain))
+        plain.close()
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Test if a BGZF coverage file is read to the end, one block at a time.
+def test_bgzf_covfile():
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'coverage.txt.bgz')
+        write_bgzf(path, 'contig1\t2.5\ncontig2\t7\ncontig3\t1\n', 10)
+        table = fasta_analyzer.ContigTable(['contig1', 'contig2', 'contig3'],
+                                           [7, 16, 25], [28.6, 37.5, 40.0], 
+                                           [0, 0, 0])
+        infile = fasta_analyzer.open_input(path)
+        assert_equal(infile.readline(), 'contig1\t2.5\n')
+        assert_equal(next(infile), 'contig2\t7\n')
+        with patch('fasta_analyzer.COV_BLOCK', 2):
+            fasta_analyzer.read_covfile(infile, table)
+        assert_equal(table.coverage.tolist(), [2.5, 7.0, 1.0])
+        assert_equal(infile.readline(), '')
+        infile.close()
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Test if the cached statistics are used until the fasta file changes.
+def test_cache():
+    tempdir = tempfile.mkdtemp()
+    path = os.path.join(tempdir, 'cached.fa')
+    fasta_file.seek(0)
+    with open(path, 'w') as outfile:
+        outfile.write(fasta_file.read())
+    try:
+        assert_equal(fasta_analyzer.load_cache(path), None)
+        with open(path) as infile:
+            table = fasta_analyzer.read_table(infile, cache = True)
+        assert_true(os.path.exists(path + '.stats.npz'))
+        cached = fasta_analyzer.load_cache(path)
+        assert_equal(cached.name.tolist(), table.name.tolist())
+        assert_equal(cached.gc.tolist(), table.gc.tolist())
+        assert_equal(cached.n_count.tolist(), [1, 2, 3])
+        with open(path, 'a') as outfile:
+            outfile.write('>contig4\nGC\n')
+        assert_equal(fasta_analyzer.load_cache(path), None)
+        with open(path) as infile:
+            table = fasta_analyzer.read_table(infile, cache = True)
+        assert_equal(len(fasta_analyzer.load_cache(path)), 4)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Test if GC content and GC skew are calculated in windows along a sequence.
+def test_gcwindows():
+    starts, ends, gc, skew = fasta_analyzer.gcwindows('GGGCAT\nNNaatt\nCC', 
+                                                      4, 3)
+    assert_equal(starts.tolist(), [0, 3, 6, 9])
+    assert_equal(ends.tolist(), [4, 7, 10, 13])
+    assert_equal(gc.tolist(), [100.0, 33.3, 0.0, 25.0])
+    assert_equal(skew[[0, 1, 3]].tolist(), [0.5, -1.0, -1.0])
+    assert_true(fasta_analyzer.isNaN(skew[2]))
+    seq = 'G' * 9 + 'A' * 7 # 56.25 is rounded up, as by gccount.
+    assert_equal(fasta_analyzer.gcwindows(seq, 16, 1)[2].tolist(), 
+                 [fasta_analyzer.Fasta('>c1', seq).gccount()])
+    outfile = StringIO.StringIO()
+    fasta_analyzer.write_gcwindows(StringIO.StringIO('>c1\nGGCC\nAT\n'), 
+                                   outfile, 4, 2)
+    assert_equal(outfile.getvalue(), 'c1\t0\t4\t100.0\t0.0000\n'\
+                                     'c1\t2\t6\t50.0\t-1.0000\n')
+    outfile = StringIO.StringIO()
+    fasta_analyzer.write_gcwindows(StringIO.StringIO('>c1 50%\nGGCC\n'), 
+                                   outfile, 4, 2)
+    assert_equal(outfile.getvalue(), 'c1 50%\t0\t4\t100.0\t0.0000\n')
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'a.fa')
+        with open(path, 'w') as outfile:
+            outfile.write('>c1\nGGCC\n')
+        args = fasta_analyzer.make_parser().parse_args(
+            [path, '-w', os.devnull, '--step', '0'])
+        with patch('sys.stderr', new_callable = StringIO.StringIO) as stderr:
+            fasta_analyzer.run(args)
+        assert_equal(stderr.getvalue(), 
+                     'ERROR: The window size and step must be at least 1.\n')
+        with open(path, 'w') as outfile:
+            outfile.write('>c1\nGG\nCCA\n>c2\nAT\n') # Can't be indexed.
+        with open(path) as infile:
+            assert_equal(fasta_analyzer.findrecord(infile, 'c1').seq, 
+                         'GG\nCCA\n')
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Test if canonical k-mer frequencies are counted, skipping k-mers with N.
+def test_kmerprofiles():
+    names, columns = fasta_analyzer.canonical_kmers(4)
+    assert_equal(len(names), 136)
+    assert_equal(names[columns[int('3233', 4)]], 'aaca')
+    profiles = fasta_analyzer.kmerprofiles(['AAC\nAG', 'gttNt', 'NN'], 2)
+    assert_equal(profiles.shape, (3, 10))
+    assert_equal(profiles.dtype.name, 'float32')
+    names = fasta_analyzer.canonical_kmers(2)[0]
+    assert_equal(dict((name, value) for name, value 
+                      in zip(names, profiles[0]) if value), 
+                 {'aa': 0.25, 'ac': 0.25, 'ag': 0.25, 'ca': 0.25})
+    assert_equal(dict((name, value) for name, value 
+                      in zip(names, profiles[1]) if value), 
+                 {'ac': 0.5, 'aa': 0.5})
+    assert_equal(profiles[2].sum(), 0)
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'kmers.npz')
+        fasta_analyzer.write_kmerprofiles(StringIO.StringIO(
+            '>c1\nACGT\n>c2\nGG\n'), path)
+        profiles = fasta_analyzer.np.load(path)
+        assert_equal(profiles['names'].tolist(), ['c1', 'c2'])
+        assert_equal(profiles['profiles'].shape, (2, 136))
+        assert_equal(profiles['profiles'][0].sum(), 1)
+        expected = profiles['profiles'].tolist()
+        profiles.close()
+        with patch('fasta_analyzer.KMER_CELLS', 137): # One contig a batch.
+            fasta_analyzer.write_kmerprofiles(StringIO.StringIO(
+                '>c1\nACGT\n>c2\nGG\n'), path)
+        assert_equal(fasta_analyzer.np.load(path)['profiles'].tolist(), 
+                     expected)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Test if the table is written as the printed report, csv and npz.
+def test_write_table():
+    table = fasta_analyzer.ContigTable(['c1', 'c2'], [10, 4], [50.0, 25.0], 
+                                       [0, 1], [2.5, float('nan')])
+    outfile = StringIO.StringIO()
+    fasta_analyzer.write_table(outfile, table)
+    assert_equal(outfile.getvalue(), 'c1 \t10 \t50.0 \t0 \t2.5\n'\
+                                     'c2 \t4 \t25.0 \t1 \t\n')
+    outfile = StringIO.StringIO()
+    fasta_analyzer.write_table(outfile, table, ['name', 'coverage'], 'csv')
+    assert_equal(outfile.getvalue(), 'name,coverage\nc1,2.5\nc2,\n')
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'table.npz')
+        with open(path, 'wb') as outfile:
+            fasta_analyzer.write_table(outfile, table, fmt = 'npz')
+        arrays = fasta_analyzer.np.load(path)
+        assert_equal(sorted(arrays.files), sorted(fasta_analyzer.TABLE_COLUMNS))
+        assert_equal(arrays['name'].tolist(), ['c1', 'c2'])
+        assert_equal(arrays['length'].tolist(), [10, 4])
+        path = os.path.join(tempdir, 'a.fa')
+        with open(path, 'w') as outfile:
+            outfile.write('>c1\nACGT\n')
+        args = fasta_analyzer.make_parser().parse_args([path, '--format', 
+                                                        'npz'])
+        with patch('sys.stdout', new_callable = StringIO.StringIO) as stdout,\
+             patch('sys.stderr', new_callable = StringIO.StringIO) as stderr:
+            fasta_analyzer.run(args)
+        assert_equal(stdout.getvalue(), '')
+        assert_equal(stderr.getvalue(), 
+                     'ERROR: --format npz needs an output file (-o).\n')
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Test if the stages of a run are timed and written as JSON.
+def test_profiler():
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'test.fa')
+        with open(path, 'w') as outfile:
+            outfile.write('>c1\nACGT\n>c2\nGGN\n')
+        profile = os.path.join(tempdir, 'profile.json')
+        stats = os.path.join(tempdir, 'profile.pstats')
+        args = fasta_analyzer.make_parser().parse_args(
+            ['-l', '-o', os.path.join(tempdir, 'table.tsv'), 
+             '--profile', profile, '--pstats', stats, path])
+        fasta_analyzer.run(args)
+        with open(profile) as infile:
+            report = json.load(infile)
+        assert_equal([stage['name'] for stage in report['stages']], 
+                     ['read_table', 'write_table'])
+        for stage in report['stages']:
+            assert_equal(sorted(stage), ['bytes_read', 'children_max_rss', 
+                                         'cpu', 'name', 'peak_growth', 
+                                         'peak_rss', 'rss', 'wall'])
+            assert_true(stage['wall'] >= 0)
+        assert_true(report['total']['peak_rss'] > 0)
+        assert_true(os.path.getsize(stats) > 0)
+        profiler = fasta_analyzer.Profiler()
+        with profiler.stage('read'):
+            open(path).read()
+        if os.path.exists('/proc/self/io'):
+            assert_true(profiler.stages[0]['bytes_read'] >= 19)
+        size = profiler.stages[0]['peak_rss'] + (64 << 20)
+        with profiler.stage('large'):
+            fasta_analyzer.np.ones(size, dtype = 'uint8')
+        with profiler.stage('small'):
+            pass
+        large, small = profiler.stages[1:]
+        assert_true(large['peak_growth'] > 32 << 20)
+        assert_equal(small['peak_growth'], 0)
+        assert_equal(small['peak_rss'], large['peak_rss'])
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Test if text-only runs start fast, without importing matplotlib.
+def test_startup():
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'test.fa')
+        with open(path, 'w') as outfile:
+            outfile.write('>c1\nACGT\n>c2\nGGN\n')
+        script = os.path.splitext(fasta_analyzer.__file__)[0] + '.py'
+        check = 'import sys, fasta_analyzer; '\
+                'fasta_analyzer.run(fasta_analyzer.make_parser().parse_args('\
+                '["-hd", "-l", "-gc", %r])); '\
+                'sys.stderr.write(str("matplotlib" in sys.modules))' % path
+        process = subprocess.Popen([sys.executable, '-c', check], 
+                                   cwd = os.path.dirname(script), 
+                                   stdout = subprocess.PIPE, 
+                                   stderr = subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        assert_equal(stdout, 'c1 \t4 \t50.0 \t\nc2 \t3 \t100.0 \t\n')
+        assert_equal(stderr, 'False')
+        times = {}
+        for name, args in [('numpy', ['-c', 'import numpy']), 
+                           ('run', [script, '-hd', '-l', path])]:
+            times[name] = []
+            for i in range(3):
+                start = time.time()
+                subprocess.check_call([sys.executable] + args,
+                                      stdout = open(os.devnull, 'w'))
+                times[name].append(time.time() - start)
+        assert_true(min(times['run']) < min(times['numpy']) + STARTUP_MARGIN)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Test if N50, L50, NG50 and the classes of the assembly are correct.
+def test_assembly_summary():
+    table = fasta_analyzer.ContigTable(['c1', 'c2', 'c3', 'c4', 'c5'], 
+                                       [200000, 50000, 40000, 5000, 5000], 
+                                       [30.0, 50.0, 60.0, float('nan'), 
+                                        50.0], [0, 0, 10000, 5000, 0])
+    summary = fasta_analyzer.assembly_summary(table, 1000000)
+    assert_equal(summary.items()[:10], [('contigs', 5), 
+                                        ('total_length', 300000), 
+                                        ('n_count', 15000), 
+                                        ('largest', 200000), 
+                                        ('N50', 200000), ('L50', 1), 
+                                        ('N90', 40000), ('L90', 3), 
+                                        ('NG50', None), ('LG50', None)])
+    assert_equal(summary['gc_mean'], 37.0)
+    assert_equal(summary['gc_p50'], 50.0)
+    assert_equal([summary['length_small'], summary['length_medium'], 
+                  summary['length_large']], [2, 2, 1])
+    assert_equal([summary['gc_low'], summary['gc_medium'], 
+                  summary['gc_high']], [1, 2, 1])
+    summary = fasta_analyzer.assembly_summary(table, 400000)
+    assert_equal((summary['NG50'], summary['LG50']), (200000, 1))
+    outfile = StringIO.StringIO()
+    fasta_analyzer.write_summary(outfile, fasta_analyzer.assembly_summary(
+        fasta_analyzer.ContigTable([], [], [], [])))
+    assert_equal(outfile.getvalue().splitlines()[:5], 
+                 ['contigs\t0', 'total_length\t0', 'n_count\t0', 
+                  'largest\tnan', 'N50\tnan'])
+
+
+
+
+
+# Test if only appended records are parsed and the checkpoint is resumed.
+def test_follower():
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'growing.fa')
+        checkpoint = os.path.join(tempdir, 'growing.npz')
+        with open(path, 'w') as outfile:
+            outfile.write('>c1\nACGT\nAC\n>c2\nGG')
+        infile = open(path)
+        follower = fasta_analyzer.Follower(infile)
+        assert_equal(follower.update().keys(), ['c1'])
+        assert_equal(follower.partial, '>c2\nGG')
+        assert_equal(follower.table().length.tolist(), [6, 2])
+        follower.save(checkpoint)
+        with open(path, 'a') as outfile:
+            outfile.write('CC\n>c3\nNNNN\n')
+        assert_true(os.path.getsize(checkpoint + '.rows') > 0)
+        follower = fasta_analyzer.Follower.load(infile, checkpoint)
+        assert_equal(follower.offset, 18)
+        with patch('fasta_analyzer.FOLLOW_CHUNK', 3): # Read in pieces.
+            assert_equal(follower.update().keys(), ['c2'])
+        assert_equal(follower.table().keys(), ['c1', 'c2', 'c3'])
+        follower.save(checkpoint)
+        follower = fasta_analyzer.Follower.load(infile, checkpoint)
+        assert_equal(follower.table().keys(), ['c1', 'c2', 'c3'])
+        summary = follower.summary()
+        assert_equal((summary['contigs'], summary['N50'], summary['L50']), 
+                     (3, 4, 2))
+        lengths, gc = follower.histograms()
+        assert_equal((lengths.sum(), gc.sum()), (3, 2))
+        with open(path, 'w') as outfile:
+            outfile.write('>c9\nA\n')
+        follower = fasta_analyzer.Follower.load(infile, checkpoint)
+        assert_equal(follower.offset, 0)
+        infile.close()
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Test if every assembly of a batch is analyzed and failures are isolated.
+def test_run_batch():
+    tempdir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(tempdir, 'a.fa'), 'w') as outfile:
+            outfile.write('>contig1\nACGTNNCC\n>contig2\nAAAA\n')
+        with open(os.path.join(tempdir, 'a.cov'), 'w') as outfile:
+            outfile.write('contig1\t12.5\ncontig2\t3\n')
+        with gzip.open(os.path.join(tempdir, 'b.fa.gz'), 'w') as outfile:
+            outfile.write('>contig1\n' + 'GC' * 50 + '\n')
+        open(os.path.join(tempdir, 'notes.txt'), 'w').close()
+        jobs = fasta_analyzer.batch_jobs(tempdir)
+        assert_equal([(os.path.basename(fasta), cov and 
+                       os.path.basename(cov)) for fasta, cov in jobs], 
+                     [('a.fa', 'a.cov'), ('b.fa.gz', None)])
+        with open(os.path.join(tempdir, 'bad.fa.gz'), 'wb') as outfile:
+            outfile.write('\x1f\x8b\x08\x00' + 'x' * 1000) # The largest.
+        manifest = os.path.join(tempdir, 'manifest.txt')
+        with open(manifest, 'w') as outfile:
+            outfile.write('a.fa\ta.cov\nmissing.fa\nb.fa.gz\nbad.fa.gz\n')
+        jobs = fasta_analyzer.batch_jobs(manifest)
+        assert_equal(jobs[1], (os.path.join(tempdir, 'missing.fa'), None))
+        table = StringIO.StringIO()
+        summary = StringIO.StringIO()
+        with patch('sys.stderr', new_callable = StringIO.StringIO) as stderr:
+            failed = fasta_analyzer.run_batch(jobs, table, summary, 2)
+        assert_equal(failed, 2)
+        assert_true('missing.fa' in stderr.getvalue())
+        rows = [line.split('\t') for line in table.getvalue().splitlines()]
+        assert_equal(rows[0], ['assembly', 'name', 'length', 'gc', 
+                               'n_count', 'coverage'])
+        assert_equal([row[0][len(tempdir) + 1:] for row in rows[1:]], 
+                     ['b.fa.gz', 'a.fa', 'a.fa'])
+        assert_equal(rows[1][1:5], ['contig1', '100', '100.0', '0'])
+        assert_equal(rows[2][1:], ['contig1', '8', '66.7', '2', '12.5'])
+        lines = [line.split('\t') for line in 
+                 summary.getvalue().splitlines()]
+        assert_equal(lines[0][:4], ['assembly', 'error', 'contigs', 
+                                    'total_length'])
+        assert_equal([line[:4] for line in lines[1:] if not line[1]], 
+                     [[jobs[2][0], '', '1', '100'], 
+                      [jobs[0][0], '', '2', '12']])
+        assert_equal([line[0] for line in lines[1:] if line[1]], 
+                     [jobs[3][0], jobs[1][0]])
+        assert_equal(set(len(line) for line in lines), set([len(lines[0])]))
+        output = os.path.join(tempdir, 'batch.tsv')
+        for threads, processes in [([], None), (['-t', '1'], 1)]:
+            args = fasta_analyzer.make_parser().parse_args(
+                ['--batch', tempdir, '-o', output] + threads)
+            with patch('fasta_analyzer.run_batch', return_value = 0) as mock:
+                fasta_analyzer.batch(args)
+            assert_equal(mock.call_args[0][3], processes)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Test if only the passing records are copied, unchanged, to the new file.
+def test_filter_fasta():
+    tempdir = tempfile.mkdtemp()
+    try:
+        records = ['>contig1 long\nACGTAC\nGTACGT\n', '>contig2\nAAAAAAAA\n', 
+                   '>contig3\nGGGG\n', '>contig4\r\nACGGCCTA\r\n']
+        path = os.path.join(tempdir, 'a.fa')
+        with open(path, 'w') as outfile:
+            outfile.write(''.join(records))
+        coverage = fasta_analyzer.read_coverage(StringIO.StringIO(
+            'contig1 long\t12\ncontig2\t3\ncontig3\tnan\n'))
+        keep = fasta_analyzer.RecordFilter(min_length = 5, 
+                                           gc_range = (40, 100))
+        for infile in (open(path), StringIO.StringIO(''.join(records))):
+            outfile = StringIO.StringIO()
+            assert_equal(fasta_analyzer.filter_fasta(infile, outfile, keep), 
+                         (2, 4))
+            assert_equal(outfile.getvalue(), records[0] + records[3])
+        keep = fasta_analyzer.RecordFilter(min_coverage = 3, 
+                                           coverage = coverage, 
+                                           exclude = set(['contig1']))
+        outfile = StringIO.StringIO()
+        with open(path) as infile:
+            fasta_analyzer.filter_fasta(infile, outfile, keep)
+        assert_equal(outfile.getvalue(), records[1])
+        names = fasta_analyzer.read_names(['>contig3\n', 'contig4 x\n', '\n'])
+        keep = fasta_analyzer.RecordFilter(names = names)
+        outfile = StringIO.StringIO()
+        with open(path) as infile:
+            fasta_analyzer.filter_fasta(infile, outfile, keep)
+        assert_equal(outfile.getvalue(), records[2] + records[3])
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Test if the histogram counts as np.histogram, merges and is saved as JSON.
+def test_loghistogram():
+    np = fasta_analyzer.np
+    values = [0.5, 1.26, 5, 5, 80, 1e6, 1e7, 2e7, float('nan')]
+    first = fasta_analyzer.LogHistogram().add(values[:4])
+    second = fasta_analyzer.LogHistogram().add(np.array(values[4:]))
+    merged = first + second
+    assert_equal(merged.counts.tolist(), 
+                 np.histogram(values[1:7], fasta_analyzer.HISTOGRAM_BINS
+                              )[0].tolist())
+    assert_equal((merged.under, merged.over, merged.missing), (1, 1, 1))
+    assert_equal((first.total(), merged.total()), (4, 9))
+    outfile = StringIO.StringIO()
+    fasta_analyzer.write_histograms(outfile, {'length': merged})
+    outfile.seek(0)
+    loaded = fasta_analyzer.read_histograms(outfile)['length']
+    assert_equal(loaded.todict(), merged.todict())
+    gc = fasta_analyzer.LogHistogram(fasta_analyzer.GC_BINS).add([50, 100])
+    assert_equal(gc.counts[[50, 99]].tolist(), [1, 1])
+    assert_raises(ValueError, merged.merge, gc)
+    outfile = StringIO.StringIO()
+    gc.write_text(outfile)
+    assert_equal(outfile.getvalue().splitlines()[:2], 
+                 ['low\thigh\tcount', '0.0\t1.0\t0'])
+
+
+
+
+
 # Test if the coverage file is read and saved in dictionary as expected.
 def test_read_covfile():
     coverage_file.seek(0)
@@ -116,6 +798,115 @@ def test_read_covfile():
 
 
 
+# Test if the coverage is joined into a table and bad lines are summarized.
+def test_read_covfile_table():
+    table = fasta_analyzer.ContigTable(['contig1', 'contig2', 'contig3'], 
+                                       [7, 16, 25], [28.6, 37.5, 40.0], 
+                                       [0, 0, 0])
+    covfile = StringIO.StringIO('contig3\t12.5\ncontig9\t4\nbroken line\n'\
+                                'contig1\tmany\ncontig8\t1\ncontig2\t3\n')
+    with patch('sys.stderr', new_callable = StringIO.StringIO) as stderr:
+        fasta_analyzer.read_covfile(covfile, table)
+    assert_equal(table.coverage[1:].tolist(), [3.0, 12.5])
+    assert_true(fasta_analyzer.isNaN(table.coverage[0]))
+    assert_equal(stderr.getvalue().splitlines(), [
+        'ERROR: Contig names did not match on 2 of 6 lines in coverage '\
+        'file (first on line 2).', 
+        'ERROR: Could not read the coverage on 2 of 6 lines in coverage '\
+        'file (first on line 3).'])
+
+
+
+
+
+# Test if the coverage matrix is aligned to the table and summarized.
+def test_read_covmatrix():
+    table = fasta_analyzer.ContigTable(['contig1', 'contig2', 'contig3'], 
+                                       [7, 16, 25], [28.6, 37.5, 40.0], 
+                                       [0, 0, 0])
+    covfile = StringIO.StringIO('contig\tA\tB\tC\n'\
+                                'contig3\t1\t3\t5\n'\
+                                'contig9\t4\t4\t4\n'\
+                                'contig1\t2\tmany\t2\n'\
+                                'contig2\t0\t0\n')
+    with patch('sys.stderr', new_callable = StringIO.StringIO) as stderr:
+        matrix = fasta_analyzer.read_covmatrix(covfile, table)
+    assert_equal(matrix.samples, ['A', 'B', 'C'])
+    assert_equal(matrix.values.dtype.name, 'float32')
+    assert_equal(matrix.values[2].tolist(), [1.0, 3.0, 5.0])
+    assert_equal(matrix.sample('C').tolist()[::2], [2.0, 5.0])
+    assert_equal(stderr.getvalue().splitlines(), [
+        'ERROR: Contig names did not match on 1 of 4 lines in coverage '\
+        'matrix (first on line 3).', 
+        'ERROR: Could not read the coverage on 2 of 4 lines in coverage '\
+        'matrix (first on line 4).'])
+    mean = matrix.mean()
+    assert_equal(mean[[0, 2]].tolist(), [2.0, 3.0])
+    assert_true(fasta_analyzer.isNaN(mean[1]))
+    assert_equal(matrix.cv()[0], 0.0)
+    assert_equal(matrix.logratio('A', 'B')[2], -1.0)
+    outfile = StringIO.StringIO()
+    fasta_analyzer.write_matrixstats(outfile, table, matrix, [('C', 'A')])
+    assert_equal(outfile.getvalue().splitlines()[::2], 
+                 ['name\tmean\tcv\tlog2(C/A)', 'contig2\tnan\tnan\tnan'])
+    covhistogram = fasta_analyzer.covhistogram
+    with patch('matplotlib.pyplot.show'):
+        assert_equal(covhistogram(table.with_coverage(matrix.sample('B')), 
+                                  sample = 'B'), [3.0])
+    table = fasta_analyzer.ContigTable(['c1', 'c2'], [7, 16], [28.6, 37.5],
+                                       [0, 0])
+    covfile = StringIO.StringIO('contig\tA\tB\nc1\t1\nc2\t2\t3\t4\n')
+    with patch('sys.stderr', new_callable = StringIO.StringIO) as stderr, \
+         patch('fasta_analyzer.physical_memory', return_value = 20):
+        matrix = fasta_analyzer.read_covmatrix(covfile, table)
+    assert_true(isinstance(matrix.values, fasta_analyzer.np.memmap))
+    assert_true(fasta_analyzer.np.isnan(matrix.values).all())
+    assert_true('on 2 of 2 lines' in stderr.getvalue())
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'matrix.tsv.bgz')
+        write_bgzf(path, 'contig\tA\tB\nc2\t2\t3\nc1\t1\t0\n', 8)
+        infile = fasta_analyzer.open_input(path)
+        matrix = fasta_analyzer.read_covmatrix(infile, table)
+        infile.close()
+        assert_equal(matrix.values.tolist(), [[1.0, 0.0], [2.0, 3.0]])
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Test if mean, median and covered fraction are calculated from depths.
+def test_read_depthfile():
+    table = fasta_analyzer.ContigTable(['contig1', 'contig2', 'contig3'], 
+                                       [4, 5, 2], [50.0, 50.0, 50.0], 
+                                       [0, 0, 0])
+    depthfile = StringIO.StringIO('contig1\t1\t3\ncontig1\t2\t0\n'\
+                                  'contig1\t4\t9\ncontig2\t1\t2\n'\
+                                  'contig2\t2\t2\ncontig2\t3\t4\n'\
+                                  'contig2\t4\t4\ncontig2\t5\t6\n')
+    mean, median, fraction = fasta_analyzer.read_depthfile(depthfile, table,
+                                                           'median')
+    assert_equal(mean.tolist(), [3.0, 3.6, 0.0])
+    assert_equal(median.tolist(), [1.5, 4.0, 0.0])
+    assert_equal(fraction.tolist(), [0.5, 1.0, 0.0])
+    assert_equal(table.coverage.tolist(), [1.5, 4.0, 0.0])
+    depthfile = StringIO.StringIO('contig1\t1\t3\ncontig2\t1\t2\n'\
+                                  'contig1\t2\t1\n')
+    dictionary = {'contig1' : fasta_analyzer.Fasta('>contig1', 'GATTACA'), 
+                  'contig2' : fasta_analyzer.Fasta('>contig2', 'GC')}
+    with patch('sys.stderr', new_callable = StringIO.StringIO) as stderr:
+        fasta_analyzer.read_depthfile(depthfile, dictionary)
+    assert_equal(dictionary['contig1'].getcoverage(), 4.0 / 7)
+    assert_equal(dictionary['contig2'].getcoverage(), 1.0)
+    assert_equal(stderr.getvalue(), "ERROR: The lines of 1 contigs are not "\
+                 "together in depth file, their median coverage is 'nan'.\n")
+
+
+
+
+
 # Lines containing a %% must be commented out to enable matplot.pyplot.show.
 #def test_lengcplot(): # This line must be uncommented to enable 
 # matplot.pyplot.show.
@@ -204,6 +995,72 @@ def test_lenhistogram(mock_pyplot_show): # %%
 
 
 
+# Test if the points are counted in a grid instead of drawn one by one.
+@patch("matplotlib.pyplot.show")
+def test_densityplot(mock_pyplot_show):
+    fig = fasta_analyzer.plt.figure()
+    ax = fig.add_subplot(111)
+    xlist = fasta_analyzer.np.array([1.0, 10.0, 100.0, 100.0, 0.0])
+    ylist = fasta_analyzer.np.array([20.0, 30.0, 40.0, 40.0, 50.0])
+    counts = fasta_analyzer.densityplot(ax, xlist, ylist, xlog = True, 
+                                        bins = 4)
+    assert_equal(counts.sum(), 4) # The 0 can't be shown on a log scale.
+    assert_equal(counts[3, 3], 2)
+    assert_equal(ax.get_xscale(), 'log')
+    fasta_analyzer.plt.close(fig)
+    with patch("fasta_analyzer.DENSITY_POINTS", 2):
+        xlist, ylist, namelist = fasta_analyzer.lengcplot(test_dict)
+    assert_equal(sorted(xlist), [7, 16, 25])
+
+
+
+
+
+# Test if the point nearest to the cursor is found through the grid.
+def test_pointindex():
+    fig = fasta_analyzer.plt.figure()
+    ax = fig.add_subplot(111)
+    ax.set_xlim(0, 100)
+    ax.set_ylim(0, 100)
+    xlist = fasta_analyzer.np.array([10.0, 50.0, 50.5, float('nan'), 90.0])
+    ylist = fasta_analyzer.np.array([10.0, 50.0, 50.0, 20.0, 90.0])
+    index = fasta_analyzer.PointIndex(ax, xlist, ylist)
+    x, y = ax.transData.transform((50.4, 50.0))
+    assert_equal(index.nearest(x, y), 2)
+    x, y = ax.transData.transform((90.0, 90.0))
+    assert_equal(index.nearest(x + 3, y - 3), 4)
+    x, y = ax.transData.transform((30.0, 30.0))
+    assert_equal(index.nearest(x, y), None)
+    ax.set_xlim(0, 20) # Zooming in moves the points on the screen.
+    x, y = ax.transData.transform((10.0, 10.0))
+    assert_equal(index.nearest(x, y), 0)
+    fasta_analyzer.plt.close(fig)
+
+
+
+
+
+# Test if the plots are saved to files, each drawn in its own process.
+def test_render_plots():
+    tempdir = tempfile.mkdtemp()
+    plotdir = os.path.join(tempdir, 'plots')
+    try:
+        table = fasta_analyzer.as_table(dict_longcontigs)
+        outfiles = fasta_analyzer.render_plots(table, 
+                                               [fasta_analyzer.lengcplot, 
+                                                fasta_analyzer.covhistogram],
+                                               plotdir, 'test', 'svg')
+        assert_equal(outfiles, [os.path.join(plotdir, 'test.lengcplot.svg'), 
+                                os.path.join(plotdir, 'test.covhistogram.svg')])
+        for outfile in outfiles:
+            assert_true(open(outfile).read().startswith('<?xml'))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
 # Close files so that they can be removed.
 def cleanup():
     fasta_file.close()
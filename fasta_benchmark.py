@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+Benchmarks for fasta_analyzer.py on synthetic assemblies.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import fasta_analyzer
+
+GAP_LENGTH = 100 # Number of N in each gap of a synthetic contig.
+MIN_LENGTH = 100 # Shortest synthetic contig.
+PLOTS = (fasta_analyzer.lengcplot, fasta_analyzer.covgcplot,
+         fasta_analyzer.covlenplot, fasta_analyzer.covhistogram,
+         fasta_analyzer.lenhistogram)
+
+
+
+
+
+def make_assembly(fastapath, covpath, contigs = 10000, length = 5000,
+                  lengthsd = 1.0, gc = 45.0, gcsd = 8.0, gaps = 1.0,
+                  width = 60, coverage = 30.0, seed = 0):
+    """Write a synthetic assembly to fastapath and a matching coverage file
+    to covpath. Contig lengths are log-normal with mean length and log
+    standard deviation lengthsd (no contig is shorter than MIN_LENGTH), the
+    GC content (%) of each contig is normal with mean gc and standard
+    deviation gcsd, each contig has on average gaps runs of GAP_LENGTH N
+    per 100 kb, and lines are width bases long. Coverage is log-normal
+    around coverage. The same seed always gives the same files. Returns the
+    number of bases written.
+    """
+    rng = np.random.RandomState(seed)
+    lengths = rng.lognormal(np.log(length) - lengthsd ** 2 / 2.0, lengthsd,
+                            contigs)
+    lengths = np.maximum(lengths.astype(np.int64), MIN_LENGTH)
+    gcs = np.clip(rng.normal(gc, gcsd, contigs), 5.0, 95.0) / 100.0
+    covs = rng.lognormal(np.log(coverage), 0.5, contigs)
+    letters = np.frombuffer('ACGT', dtype = np.uint8)
+    with open(fastapath, 'w') as fastafile:
+        for i in xrange(contigs):
+            size = lengths[i]
+            strong = rng.random_sample(size) < gcs[i]
+            pick = rng.randint(0, 2, size)
+            seq = letters[np.where(strong, 1 + pick, 3 * pick)]
+            for start in rng.randint(0, size, rng.poisson(gaps * size / 1e5)):
+                seq[start:start + GAP_LENGTH] = ord('N')
+            seq = seq.tostring()
+            fastafile.write('>contig_%d\n' % i)
+            fastafile.write('\n'.join([seq[start:start + width] for start
+                                       in xrange(0, size, width)]) + '\n')
+    with open(covpath, 'w') as covfile:
+        covfile.write(''.join(['contig_%d\t%.2f\n' %(i, cov)
+                               for i, cov in enumerate(covs)]))
+    return int(lengths.sum())
+
+
+
+
+
+def best_time(function, repeat, setup = None):
+    """Return the shortest wall time in seconds of repeat calls of function.
+    setup is called before each call, outside the timing.
+    """
+    times = []
+    for i in xrange(repeat):
+        if setup:
+            setup()
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times)
+
+
+
+
+
+def run_benchmarks(fastapath, covpath, repeat = 3):
+    """Time the stages of fasta_analyzer on the given fasta and coverage
+    files. Returns a list of (stage, seconds, bytes, contigs) with the best
+    time of repeat runs. The plot stages are timed without drawing: the
+    plots are built with the Agg backend and closed instead of shown.
+    """
+    fasta_analyzer.plt.switch_backend('Agg')
+    fastasize = os.path.getsize(fastapath)
+    covsize = os.path.getsize(covpath)
+    results = []
+
+    def read_file():
+        with open(fastapath) as infile:
+            contigs.update(fasta_analyzer.read_file(infile))
+    contigs = {}
+    results.append(('read_file', best_time(read_file, repeat), fastasize))
+
+    def read_covfile():
+        with open(covpath) as infile:
+            fasta_analyzer.read_covfile(infile, contigs)
+    results.append(('read_covfile', best_time(read_covfile, repeat),
+                    covsize))
+
+    def clear_counts():
+        for fs in contigs.itervalues():
+            fs.counts = None
+    def gccount():
+        for fs in contigs.itervalues():
+            fs.gccount()
+    results.append(('Fasta.gccount', best_time(gccount, repeat, clear_counts),
+                    fastasize))
+
+    def read_table():
+        with open(fastapath) as infile:
+            table[0] = fasta_analyzer.read_table(infile)
+        with open(covpath) as infile:
+            fasta_analyzer.read_covfile(infile, table[0])
+    table = [None]
+    results.append(('read_table', best_time(read_table, repeat),
+                    fastasize + covsize))
+
+    def run():
+        args = fasta_analyzer.make_parser().parse_args(
+            ['-hd', '-l', '-gc', '-n', fastapath, covpath])
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            fasta_analyzer.run(args)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    results.append(('run (text output)', best_time(run, repeat),
+                    fastasize + covsize))
+
+    show = fasta_analyzer.plt.show
+    fasta_analyzer.plt.show = lambda: fasta_analyzer.plt.close('all')
+    try:
+        for plot in PLOTS:
+            results.append((plot.__name__,
+                            best_time(lambda: plot(table[0]), repeat), 0))
+    finally:
+        fasta_analyzer.plt.show = show
+    return [(stage, seconds, size, len(table[0]))
+            for stage, seconds, size in results]
+
+
+
+
+
+def report(results, outfile = sys.stdout):
+    """Print the time, MB/s and contigs/s of each stage from run_benchmarks.
+    """
+    outfile.write('%-20s %10s %10s %12s\n'
+                  %('stage', 'seconds', 'MB/s', 'contigs/s'))
+    for stage, seconds, size, contigs in results:
+        seconds = max(seconds, 1e-9)
+        outfile.write('%-20s %10.3f %10s %12.0f\n'
+                      %(stage, seconds,
+                        '%.1f' %(size / seconds / 1e6) if size else '-',
+                        contigs / seconds))
+
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description =
+                                 """Generate a synthetic assembly and
+                                    coverage file and time the stages of
+                                    fasta_analyzer on them.
+                                    """)
+
+    parser.add_argument("--contigs",
+                    help = "Number of contigs (default: 10000).",
+                    type = int,
+                    default = 10000)
+
+    parser.add_argument("--length",
+                    help = "Mean contig length (default: 5000).",
+                    type = int,
+                    default = 5000)
+
+    parser.add_argument("--lengthsd",
+                    help = "Standard deviation of the log contig length "
+                           "(default: 1.0).",
+                    type = float,
+                    default = 1.0)
+
+    parser.add_argument("--gc",
+                    help = "Mean GC content in %% (default: 45).",
+                    type = float,
+                    default = 45.0)
+
+    parser.add_argument("--gcsd",
+                    help = "Standard deviation of the GC content "
+                           "(default: 8).",
+                    type = float,
+                    default = 8.0)
+
+    parser.add_argument("--gaps",
+                    help = "Runs of %d N per 100 kb (default: 1)."
+                           % GAP_LENGTH,
+                    type = float,
+                    default = 1.0)
+
+    parser.add_argument("--width",
+                    help = "Line width of the fasta file (default: 60).",
+                    type = int,
+                    default = 60)
+
+    parser.add_argument("--seed",
+                    help = "Random seed (default: 0).",
+                    type = int,
+                    default = 0)
+
+    parser.add_argument("--repeat",
+                    help = "Report the best of this many runs (default: 3).",
+                    type = int,
+                    default = 3)
+
+    parser.add_argument("--outdir",
+                    help = "Keep assembly.fa and coverage.txt in this "
+                           "directory instead of a temporary one.")
+
+    args = parser.parse_args()
+    outdir = args.outdir or tempfile.mkdtemp()
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    fastapath = os.path.join(outdir, 'assembly.fa')
+    covpath = os.path.join(outdir, 'coverage.txt')
+    try:
+        start = time.time()
+        bases = make_assembly(fastapath, covpath, args.contigs, args.length,
+                              args.lengthsd, args.gc, args.gcsd, args.gaps,
+                              args.width, seed = args.seed)
+        sys.stderr.write("Generated %d contigs, %d bases in %.1f s.\n"
+                         %(args.contigs, bases, time.time() - start))
+        report(run_benchmarks(fastapath, covpath, args.repeat))
+    finally:
+        if not args.outdir:
+            shutil.rmtree(outdir)
@@ -0,0 +1,60 @@
+from nose.tools import *
+import fasta_analyzer
+import fasta_benchmark
+import os
+import shutil
+import StringIO
+import tempfile
+
+
+
+
+
+# Test if the synthetic assembly is reproducible and matches its coverage.
+def test_make_assembly():
+    tempdir = tempfile.mkdtemp()
+    try:
+        paths = [os.path.join(tempdir, name) for name
+                 in ('a.fa', 'a.cov', 'b.fa', 'b.cov')]
+        bases = fasta_benchmark.make_assembly(paths[0], paths[1], 20,
+                                              length = 500, gaps = 50.0,
+                                              width = 50)
+        fasta_benchmark.make_assembly(paths[2], paths[3], 20, length = 500,
+                                      gaps = 50.0, width = 50)
+        assert_equal(open(paths[0]).read(), open(paths[2]).read())
+        with open(paths[0]) as infile:
+            contigs = fasta_analyzer.read_file(infile)
+        assert_equal(len(contigs), 20)
+        assert_equal(sum(fs.length() for fs in contigs.values()), bases)
+        assert_true(sum(fs.ncontent() for fs in contigs.values()) > 0)
+        assert_true(max(len(line) for line in open(paths[0])) <= 51)
+        with open(paths[1]) as infile:
+            fasta_analyzer.read_covfile(infile, contigs)
+        assert_true(all(fs.getcoverage() > 0 for fs in contigs.values()))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+
+
+
+# Test if every stage is timed and reported.
+def test_run_benchmarks():
+    tempdir = tempfile.mkdtemp()
+    try:
+        fastapath = os.path.join(tempdir, 'a.fa')
+        covpath = os.path.join(tempdir, 'a.cov')
+        fasta_benchmark.make_assembly(fastapath, covpath, 10, length = 200)
+        results = fasta_benchmark.run_benchmarks(fastapath, covpath, 1)
+        assert_equal([stage for stage, seconds, size, contigs in results],
+                     ['read_file', 'read_covfile', 'Fasta.gccount',
+                      'read_table', 'run (text output)', 'lengcplot',
+                      'covgcplot', 'covlenplot', 'covhistogram',
+                      'lenhistogram'])
+        assert_true(all(contigs == 10 for stage, seconds, size, contigs
+                        in results))
+        outfile = StringIO.StringIO()
+        fasta_benchmark.report(results, outfile)
+        assert_equal(len(outfile.getvalue().splitlines()), 11)
+    finally:
+        shutil.rmtree(tempdir)